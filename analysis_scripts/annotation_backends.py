@@ -0,0 +1,156 @@
+"""
+Chat completion backends for the hyperobject annotator.
+
+A backend takes the chat messages of one request and returns the reply text together
+with the token usage. Failures are raised as BackendError carrying the HTTP status, so
+the annotator decides whether to retry without knowing which client produced them.
+
+OpenAIBackend talks to the OpenAI API (or a compatible server), MockBackend is a
+deterministic offline stub for tests and benchmarks.
+"""
+import os
+import json
+import random
+import asyncio
+import hashlib
+
+
+class BackendError(Exception):
+    """A failed completion request (status is None for connection errors and timeouts)"""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        """Rate limits, server errors and connection failures are worth retrying"""
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+def _retry_after(response):
+    """Seconds to wait according to the Retry-After header of a response, if any"""
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class OpenAIBackend:
+    """Chat completions through the OpenAI async client (base_url points it at a compatible stub)"""
+
+    def __init__(self, model="gpt-4o", api_key=None, base_url=None, timeout=120.0):
+        from openai import AsyncOpenAI
+
+        self.model = model
+        # Retries are handled by the annotator so they go through its rate limiter
+        self.client = AsyncOpenAI(
+            api_key=api_key or os.getenv('OPENAI_API_KEY'),
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=0
+        )
+
+    async def complete(self, messages, max_tokens=8000, temperature=1, response_format=None):
+        """
+        Run one chat completion (response_format constrains the reply, e.g. to a JSON schema).
+
+        Returns:
+            tuple: (reply text, {'prompt_tokens': int, 'completion_tokens': int})
+        """
+        import openai
+
+        options = {}
+        if response_format is not None:
+            options['response_format'] = response_format
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **options
+            )
+        except openai.APIStatusError as e:
+            raise BackendError(str(e), status=e.status_code, retry_after=_retry_after(e.response)) from e
+        except openai.APIConnectionError as e:
+            raise BackendError(str(e)) from e
+
+        usage = {'prompt_tokens': 0, 'completion_tokens': 0}
+        if response.usage:
+            usage = {
+                'prompt_tokens': response.usage.prompt_tokens,
+                'completion_tokens': response.usage.completion_tokens
+            }
+        return (response.choices[0].message.content or '').strip(), usage
+
+
+class MockBackend:
+    """
+    Deterministic offline stand-in for a chat completion backend.
+
+    The reply, the simulated latency and any failure are derived from a hash of the
+    request and the number of times that request has been sent, so a run gives the
+    same results whatever order the requests go out in. Failures are rate limits
+    (429 with a Retry-After) and server errors (500). Each image gets a description
+    that depends only on the image, whether it is sent alone or in a batch.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.5, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=0.1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.attempts = {}
+        self.calls = 0
+        self.failures = 0
+        self.bytes_received = 0
+
+    def describe(self, image_url):
+        """The description the mock gives for an image"""
+        digest = hashlib.sha1(f"{self.seed}:{image_url}".encode('utf-8')).hexdigest()
+        return f"Descripción simulada {digest[:12]}"
+
+    async def complete(self, messages, max_tokens=8000, temperature=1, response_format=None):
+        texts = []
+        images = []
+        for message in messages:
+            content = message['content']
+            for part in ([{'type': 'text', 'text': content}] if isinstance(content, str) else content):
+                if part['type'] == 'text':
+                    texts.append(part['text'])
+                else:
+                    images.append(part['image_url']['url'])
+
+        request = hashlib.sha1(json.dumps([self.seed, texts, images]).encode('utf-8')).hexdigest()
+        attempt = self.attempts.get(request, 0)
+        self.attempts[request] = attempt + 1
+        rng = random.Random(f"{request}:{attempt}")
+        self.calls += 1
+        self.bytes_received += sum(len(url) for url in images)
+
+        await asyncio.sleep(self.latency * rng.uniform(1 - self.jitter, 1 + self.jitter))
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            self.failures += 1
+            raise BackendError("Simulated rate limit", status=429, retry_after=self.retry_after)
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.failures += 1
+            raise BackendError("Simulated server error", status=500)
+
+        descriptions = [self.describe(url) for url in images]
+        if response_format is not None:
+            text = json.dumps({'descriptions': [
+                {'id': str(i), 'texto': description} for i, description in enumerate(descriptions, 1)
+            ]}, ensure_ascii=False)
+        else:
+            text = descriptions[0] if descriptions else ''
+        usage = {
+            'prompt_tokens': sum(len(t) for t in texts) // 4 + 85 * len(images),
+            'completion_tokens': len(text) // 4
+        }
+        return text, usage
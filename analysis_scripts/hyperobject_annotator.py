@@ -5,33 +5,648 @@ from pathlib import Path
 from dotenv import load_dotenv
 from openai import OpenAI
 import base64
+import bisect
+import time
+import random
+import asyncio
+import argparse
+import hashlib
+import math
+import io
+import shutil
+import tempfile
+import contextlib
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
 from tqdm import tqdm
 
+from annotation_backends import OpenAIBackend, MockBackend, BackendError
+
 load_dotenv()
 
+PROMPT_TEMPLATE = """
+            Observa los presentes en esta imagen.
+
+            Genera una descripción que:
+            1. Identifique y describa objetos, formas o elementos específicos visibles en la imagen
+            2. Presente estos elementos de manera difusa o creativa, sugiriendo múltiples interpretaciones posibles
+            3. Mantenga un balance entre lo concreto de los elementos observados y lo difuso de su interpretación, relacionándolo con la categoría '{category}'
+            
+            No hagas mención de la imagen solo escribe la idea.
+            """
+
+# Appended to the prompt when the image is a contact sheet of several frames
+CONTACT_SHEET_NOTE = """
+            La imagen es un mosaico de fotogramas del mismo video en orden temporal; trátalos como una sola escena.
+            """
+
+# Appended to the prompt of a batched request; each image is preceded by its id
+BATCH_NOTE = """
+            Recibirás {count} imágenes de videos distintos, cada una precedida por su identificador.
+            Escribe una descripción independiente para cada identificador.
+            """
+
+# Structured response of a batched request: one description per video id
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "descripciones",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "descriptions": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "string"},
+                            "texto": {"type": "string"}
+                        },
+                        "required": ["id", "texto"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["descriptions"],
+            "additionalProperties": False
+        }
+    }
+}
+
+def parse_batch_response(text, ids):
+    """
+    Split the JSON reply of a batched request into descriptions.
+
+    Items with an unknown or repeated id, or without a non-empty description, are
+    dropped, so their videos are retried on their own.
+
+    Returns:
+        dict: id -> description for the valid items
+    """
+    try:
+        items = json.loads(text)['descriptions']
+    except (ValueError, TypeError, KeyError):
+        return {}
+    descriptions = {}
+    if not isinstance(items, list):
+        return descriptions
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        item_id = str(item.get('id', '')).strip()
+        texto = item.get('texto')
+        if item_id in ids and item_id not in descriptions and isinstance(texto, str) and texto.strip():
+            descriptions[item_id] = texto.strip()
+    return descriptions
+
+def dhash(frame, hash_size=8):
+    """
+    Difference hash of a BGR frame: the sign of horizontal gradients on a
+    (hash_size + 1) x hash_size grayscale thumbnail, packed into an int.
+
+    Re-encodes, rescales and small edits of a frame only flip a few bits.
+    Returns the hashes of the frame rotated by 0, 90, 180 and 270 degrees, so a
+    `_rotated` export of a clip matches the frames of the original.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    hashes = []
+    for turns in range(4):
+        rotated = np.rot90(gray, turns)
+        small = cv2.resize(np.ascontiguousarray(rotated), (hash_size + 1, hash_size),
+                           interpolation=cv2.INTER_AREA)
+        bits = (small[:, 1:] > small[:, :-1]).flatten()
+        hashes.append(int(np.packbits(bits).tobytes().hex(), 16))
+    return hashes
+
+def hash_detail(frame, hash_size=8, threshold=8):
+    """
+    Fraction of the dhash() gradients that are at least `threshold` gray levels.
+
+    Dark frames, fades and text cards (small text on a flat background) have nearly
+    flat hash thumbnails, so their hash bits are mostly noise and different frames of
+    that kind end up a few bits apart.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return float((np.abs(small[:, 1:] - small[:, :-1]) >= threshold).mean())
+
+def score_frames(frames):
+    """
+    Score a stack of frames (N x H x W x 3, BGR) for how well each one represents the clip.
+
+    Combines three per-frame measures, each rescaled to [0, 1] across the stack:
+    sharpness (variance of the image gradients), colourfulness (Hasler and Suesstrunk)
+    and scene change (mean absolute difference to the neighbouring samples). Frames
+    that are nearly black or flat, such as fades and title cards, score low on all three.
+
+    Returns:
+        np.ndarray: One score per frame
+    """
+    stack = frames.astype(np.float32)
+    b, g, r = stack[..., 0], stack[..., 1], stack[..., 2]
+    gray = 0.114 * b + 0.587 * g + 0.299 * r
+
+    sharpness = np.diff(gray, axis=2).var(axis=(1, 2)) + np.diff(gray, axis=1).var(axis=(1, 2))
+
+    rg = r - g
+    yb = 0.5 * (r + g) - b
+    colourfulness = (np.sqrt(rg.std(axis=(1, 2)) ** 2 + yb.std(axis=(1, 2)) ** 2)
+                     + 0.3 * np.sqrt(rg.mean(axis=(1, 2)) ** 2 + yb.mean(axis=(1, 2)) ** 2))
+
+    change = np.zeros(len(frames), dtype=np.float32)
+    if len(frames) > 1:
+        steps = np.abs(np.diff(gray, axis=0)).mean(axis=(1, 2))
+        change[1:] += steps
+        change[:-1] += steps
+        change[1:-1] /= 2
+
+    def rescale(values):
+        span = values.max() - values.min()
+        return (values - values.min()) / span if span > 0 else np.zeros_like(values)
+
+    return rescale(sharpness) + rescale(colourfulness) + 0.5 * rescale(change)
+
+def pick_frames(scores, count):
+    """
+    Indices of the `count` best scored frames in temporal order, keeping picks at least
+    len(scores) / (2 * count) samples apart so they cover different parts of the clip.
+    """
+    min_gap = len(scores) // (2 * count)
+    picked = []
+    for i in np.argsort(-scores, kind='stable'):
+        if all(abs(i - j) >= min_gap for j in picked):
+            picked.append(i)
+        if len(picked) == count:
+            break
+    return sorted(int(i) for i in picked)
+
+def tile_frames(frames):
+    """Tile equally sized frames row by row into a near-square contact sheet"""
+    cols = int(np.ceil(np.sqrt(len(frames))))
+    rows = int(np.ceil(len(frames) / cols))
+    height, width = frames[0].shape[:2]
+    sheet = np.zeros((rows * height, cols * width, 3), dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        row, col = divmod(i, cols)
+        sheet[row * height:(row + 1) * height, col * width:(col + 1) * width] = frame
+    return sheet
+
+class PayloadBudget:
+    """
+    How frames are encoded for a request.
+
+    Frames are downscaled so their longest edge is at most `max_edge`, then JPEG encoded
+    at the highest quality (binary searched between `min_quality` and `max_quality`)
+    that fits in `target_bytes`. `detail` is the image detail tier of the request:
+    "low" is billed a flat 85 tokens for a 512 px image, "high" by 512 px tiles.
+    """
+    # Vision token pricing of the image detail tiers
+    BASE_TOKENS = 85
+    TILE_TOKENS = 170
+
+    def __init__(self, max_edge=1024, target_bytes=150000, min_quality=40, max_quality=90, detail='high'):
+        if detail not in ('low', 'high'):
+            raise ValueError(f"Unknown image detail tier: {detail}")
+        self.detail = detail
+        # The low tier is looked at as a 512 px image, anything larger is wasted bytes
+        self.max_edge = min(max_edge, 512) if detail == 'low' else max_edge
+        self.target_bytes = target_bytes
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+
+    def image_tokens(self, width, height):
+        """Tokens an image of this size costs at the budget's detail tier"""
+        if self.detail == 'low':
+            return self.BASE_TOKENS
+        # Fit in 2048 x 2048, then shrink the short side to 768, then count 512 px tiles
+        scale = min(1.0, 2048 / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1.0, 768 / min(width, height))
+        width, height = width * scale, height * scale
+        return self.BASE_TOKENS + self.TILE_TOKENS * math.ceil(width / 512) * math.ceil(height / 512)
+
+    def encode(self, frame):
+        """
+        Encode a frame within the budget.
+
+        Returns:
+            dict: 'image' (base64 JPEG), 'bytes', 'quality', 'width', 'height' and
+                  'image_tokens', or None if the frame could not be encoded
+        """
+        height, width = frame.shape[:2]
+        scale = self.max_edge / max(width, height)
+        if scale < 1:
+            width, height = max(1, round(width * scale)), max(1, round(height * scale))
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+        best = None
+        low, high = self.min_quality, self.max_quality
+        while low <= high:
+            quality = (low + high) // 2
+            ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ret:
+                return None
+            if len(buffer) <= self.target_bytes or best is None:
+                best = (quality, buffer)
+            if len(buffer) <= self.target_bytes:
+                low = quality + 1
+            else:
+                high = quality - 1
+        if best[0] > self.min_quality and len(best[1]) > self.target_bytes:
+            # Nothing fits: fall back to the smallest encoding
+            ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.min_quality])
+            best = (self.min_quality, buffer)
+
+        quality, buffer = best
+        return {
+            'image': base64.b64encode(buffer).decode('utf-8'),
+            'bytes': len(buffer),
+            'quality': quality,
+            'width': width,
+            'height': height,
+            'image_tokens': self.image_tokens(width, height)
+        }
+
+class ResponseCache:
+    """
+    Persistent cache of descriptions keyed by what was asked: the perceptual hash
+    of the frame plus a digest of the category, the prompt template and the model
+    parameters.
+
+    A lookup matches any stored frame of the same request context within
+    `max_distance` differing hash bits, so re-exported, rotated or re-run clips reuse
+    their description instead of paying for a new request. Only frames with at least
+    `min_detail` of their hash gradients above noise (see hash_detail()) are matched
+    that way; for dark frames, fades and text cards the hash cannot tell different
+    frames apart, so they are keyed by the clip identity and only match exactly. The
+    cache keeps at most `max_entries` descriptions and evicts the least recently used ones.
+
+    Lookups run in worker threads (load_frame) while the event loop stores and saves
+    descriptions, so every access to the entries holds `lock`.
+    """
+
+    def __init__(self, cache_file='annotation_cache.json', max_entries=10000, max_distance=4,
+                 min_detail=0.25):
+        self.cache_file = Path(cache_file)
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.min_detail = min_detail
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        if self.cache_file.exists():
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    for context, frame_key, description in json.load(f):
+                        if not frame_key.startswith('clip:'):
+                            frame_key = int(frame_key, 16)
+                        self.entries[(context, frame_key)] = description
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable response cache {self.cache_file}: {str(e)}")
+
+    @staticmethod
+    def context(category, model_params):
+        """Digest of everything besides the frame that shapes the response"""
+        key = json.dumps([category, PROMPT_TEMPLATE, model_params], sort_keys=True)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+    def frame_key(self, frame, identity):
+        """
+        Cache key of a frame: its dhash() if it has enough detail for near matches,
+        otherwise 'clip:<identity>' (the clip fingerprint, or its path), matched exactly
+        """
+        if hash_detail(frame) >= self.min_detail:
+            return dhash(frame)
+        return f"clip:{identity}"
+
+    def get(self, context, frame_key):
+        """
+        Look up a description for a frame.
+
+        Args:
+            context (str): Request context from context()
+            frame_key (list or str): frame_key() of the frame
+
+        Returns:
+            str: Cached description, or None
+        """
+        best = None
+        best_distance = self.max_distance + 1
+        exact = (context, frame_key if isinstance(frame_key, str) else frame_key[0])
+        with self.lock:
+            if exact in self.entries:
+                best, best_distance = exact, 0
+            elif not isinstance(frame_key, str):
+                for key in self.entries:
+                    if key[0] != context or isinstance(key[1], str):
+                        continue
+                    distance = min((key[1] ^ frame_hash).bit_count() for frame_hash in frame_key)
+                    if distance < best_distance:
+                        best, best_distance = key, distance
+            if best is None:
+                self.misses += 1
+                return None
+            if best_distance:
+                self.near_hits += 1
+            else:
+                self.hits += 1
+            self.entries.move_to_end(best)
+            return self.entries[best]
+
+    def put(self, context, frame_key, description):
+        key = (context, frame_key if isinstance(frame_key, str) else frame_key[0])
+        with self.lock:
+            self.entries[key] = description
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.near_hits + self.misses
+        return (self.hits + self.near_hits) / lookups if lookups else 0.0
+
+    def report(self):
+        print(f"Response cache: {self.hits} hits, {self.near_hits} near hits, {self.misses} misses "
+              f"({self.hit_rate():.1%} hit rate, {len(self.entries)} entries)")
+
+    def save(self):
+        """Write the cache atomically, least recently used entries first"""
+        with self.lock:
+            rows = [[context, frame_key if isinstance(frame_key, str) else format(frame_key, '016x'),
+                     description]
+                    for (context, frame_key), description in self.entries.items()]
+        tmp_file = self.cache_file.with_name(self.cache_file.name + '.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most capacity.
+
+    acquire() waits until the requested amount is available. Waiters are served in
+    order, so a large request is not starved by a stream of small ones.
+    """
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        async with self.lock:
+            # A request larger than the bucket only waits for a full bucket
+            amount_needed = min(amount, self.capacity)
+            while True:
+                self._refill()
+                if self.tokens >= amount_needed:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount_needed - self.tokens) / self.rate)
+
+    def adjust(self, amount):
+        """Charge (positive) or refund (negative) tokens once the real cost is known"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits applied together"""
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, estimated_tokens):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
+
+    def settle(self, estimated_tokens, used_tokens):
+        self.tokens.adjust(used_tokens - estimated_tokens)
+
+class AnnotationJournal:
+    """
+    Append-only NDJSON journal of descriptions, one {"path", "fingerprint", "texto"}
+    record per line.
+
+    Records are flushed on every append and fsynced in batches (every `sync_every`
+    records or `sync_interval` seconds), so a crash loses at most one batch. The
+    annotator replays the journal on start and truncates it once the descriptions
+    have been compacted into the annotated ontology.
+    """
+    def __init__(self, journal_file, sync_every=16, sync_interval=1.0):
+        self.journal_file = Path(journal_file)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.file = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def replay(self):
+        """
+        Records of the journal. Unreadable lines are skipped, and a last line cut
+        short by a crash is truncated away so later appends start on a fresh line.
+        """
+        records = []
+        if not self.journal_file.exists():
+            return records
+        with open(self.journal_file, 'rb+') as f:
+            offset = 0
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    print(f"Skipping unreadable journal line at byte {offset}")
+                    if not line.endswith(b'\n'):
+                        f.truncate(offset)
+                        break
+                else:
+                    if not line.endswith(b'\n'):
+                        # Complete record whose newline was not written
+                        f.write(b'\n')
+                offset += len(line)
+        return records
+
+    def append(self, path, texto, fingerprint=None):
+        if self.file is None:
+            self.file = open(self.journal_file, 'a', encoding='utf-8')
+        record = {'path': path, 'texto': texto}
+        if fingerprint:
+            record['fingerprint'] = fingerprint
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def reset(self):
+        """Drop the journal once its records are in the compacted output"""
+        self.close()
+        if self.journal_file.exists():
+            self.journal_file.unlink()
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
 class HyperobjectAnnotator:
-    def __init__(self, ontology_file='ontology_map.json', output_file='annotated_ontology.json'):
-        """Initialize the annotator with OpenAI client and load ontology"""
-        self.client = OpenAI(
-            api_key=os.getenv('OPENAI_API_KEY')
-        )
+    MODEL = "gpt-4o"
+    MAX_TOKENS = 8000
+    TEMPERATURE = 1
+
+    def __init__(self, ontology_file='ontology_map.json', output_file='annotated_ontology.json',
+                 backend=None, base_url=None, compact_every=50, cache_file='annotation_cache.json',
+                 cache_size=10000, cache_distance=4, frames=1, samples=32, budget=None,
+                 request_log=None):
+        """Initialize the annotator with OpenAI client and load ontology
+        
+        backend replaces the OpenAI client in the concurrent mode (see annotation_backends),
+        base_url points the default client at an OpenAI compatible server.
+        New descriptions go to a journal next to the output file, which is compacted into
+        the output every `compact_every` descriptions and at the end of a run.
+        Responses are cached by frame and prompt in `cache_file` (None disables the cache).
+        With frames > 1 each request sends a contact sheet of the best `frames` out of
+        `samples` frames decoded across the clip instead of the middle frame.
+        Images are encoded within `budget` (a PayloadBudget); bytes and tokens of every
+        request are printed and, with `request_log`, appended to that NDJSON file.
+        """
+        self.backend = backend
+        self.base_url = base_url
+        self.client = None
+        if backend is None:
+            self.client = OpenAI(
+                api_key=os.getenv('OPENAI_API_KEY'),
+                base_url=base_url
+            )
         
         self.output_file = output_file
         
         # Load existing annotations if they exist
+        previous = []
         if os.path.exists(output_file):
             with open(output_file, 'r', encoding='utf-8') as f:
-                self.ontology = json.load(f)
-                print(f"Loaded {len(self.ontology)} existing annotations")
-        else:
-            # Load fresh ontology if no annotations exist
+                previous = json.load(f)
+                print(f"Loaded {len(previous)} existing annotations")
+
+        if os.path.exists(ontology_file) or not previous:
+            # Load the current ontology and carry existing annotations over to it
             with open(ontology_file, 'r', encoding='utf-8') as f:
                 self.ontology = json.load(f)
+            carried, dropped = self.carry_over_annotations(previous)
+            if dropped and dropped == sum(1 for video in previous if 'texto' in video):
+                # e.g. an output written before the archive was reorganized or fingerprinted:
+                # keep annotating it rather than erasing every description on compaction
+                print(f"Warning: none of the {dropped} annotations in {output_file} match an entry of "
+                      f"{ontology_file}, resuming from {output_file} instead")
+                self.ontology = previous
+            elif carried or dropped:
+                print(f"Carried over {carried} annotations, dropped {dropped} of clips no longer in {ontology_file}")
+        else:
+            self.ontology = previous
+
+        # Descriptions of an interrupted run that were not compacted yet
+        self.journal = AnnotationJournal(
+            Path(output_file).with_name(Path(output_file).stem + '_journal.ndjson'))
+        replayed, dropped = self.carry_over_annotations(self.journal.replay())
+        if replayed or dropped:
+            print(f"Replayed {replayed} annotations from {self.journal.journal_file}, "
+                  f"dropped {dropped} of clips no longer in the ontology")
+
+        self.by_path = {video['path']: video for video in self.ontology}
+        self.by_fingerprint = {}
+        for video in self.ontology:
+            if video.get('fingerprint'):
+                self.by_fingerprint.setdefault(video['fingerprint'], []).append(video)
+        self.compact_every = compact_every
+        self.uncompacted = replayed
+        self.uncompacted_at_start = replayed
+
+        self.cache = None
+        if cache_file:
+            self.cache = ResponseCache(cache_file, max_entries=cache_size, max_distance=cache_distance)
+        self.cache_context = {}
+        self.frames = frames
+        self.samples = samples
+        self.budget = budget or PayloadBudget()
+        self.request_log = request_log
+        self.totals = {'requests': 0, 'bytes': 0, 'image_tokens': 0,
+                       'prompt_tokens': 0, 'completion_tokens': 0, 'latency': 0.0}
             
         self.root_dir = Path("Generados")
+        
+        # Keyframe index written by the mapper next to the ontology (path -> [pts_us, byte offset])
+        keyframe_file = Path(ontology_file).with_name(Path(ontology_file).stem + '_keyframes.json')
+        self.keyframes = {}
+        if keyframe_file.exists():
+            with open(keyframe_file, 'r', encoding='utf-8') as f:
+                self.keyframes = json.load(f)
+
+    def carry_over_annotations(self, previous):
+        """
+        Copy descriptions from a previous annotation run onto the current ontology.
+        Entries are matched by path first and then by content fingerprint, so clips that
+        were moved, renamed or duplicated keep their description without a new request.
+
+        Returns:
+            tuple: (number of entries that received a description, number of previous
+                   descriptions whose clip matches no entry by path or fingerprint)
+        """
+        paths = {video['path'] for video in self.ontology}
+        fingerprints = {video['fingerprint'] for video in self.ontology if video.get('fingerprint')}
+        dropped = sum(1 for video in previous
+                      if 'texto' in video and video['path'] not in paths
+                      and video.get('fingerprint') not in fingerprints)
+
+        by_path = {}
+        by_fingerprint = {}
+        for video in list(previous) + list(self.ontology):
+            if 'texto' in video:
+                by_path.setdefault(video['path'], video['texto'])
+                if video.get('fingerprint'):
+                    by_fingerprint.setdefault(video['fingerprint'], video['texto'])
+
+        carried = 0
+        for video in self.ontology:
+            if 'texto' in video:
+                continue
+            texto = by_path.get(video['path']) or by_fingerprint.get(video.get('fingerprint'))
+            if texto:
+                video['texto'] = texto
+                carried += 1
+        return carried, dropped
 
-    def extract_middle_frame(self, video_path):
-        """Extract a frame from the middle of the video"""
+    def extract_middle_frame(self, video_path, keyframes=None):
+        """Extract a frame from the middle of the video as base64 JPEG"""
+        frame = self.read_middle_frame(video_path, keyframes)
+        if frame is None:
+            return None
+        payload = self.encode_frame(frame)
+        return payload['image'] if payload else None
+
+    def read_middle_frame(self, video_path, keyframes=None):
+        """Decode a frame from the middle of the video
+        
+        With a keyframe index ([pts_us, byte offset] pairs) the keyframe closest to the
+        middle is used, so the seek lands on it directly instead of decoding forward
+        from the previous keyframe.
+        """
+        cap = None
         try:
             cap = cv2.VideoCapture(str(video_path))
             if not cap.isOpened():
@@ -39,64 +654,262 @@ class HyperobjectAnnotator:
             
             total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
             middle_frame = total_frames // 2
+            fps = cap.get(cv2.CAP_PROP_FPS)
             
-            cap.set(cv2.CAP_PROP_POS_FRAMES, middle_frame)
+            if keyframes and fps > 0:
+                middle_us = middle_frame / fps * 1000000
+                i = bisect.bisect_left([pts for pts, _ in keyframes], middle_us)
+                candidates = keyframes[max(i - 1, 0):i + 1]
+                pts_us = min(candidates, key=lambda keyframe: abs(keyframe[0] - middle_us))[0]
+                cap.set(cv2.CAP_PROP_POS_MSEC, pts_us / 1000)
+            else:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, middle_frame)
             ret, frame = cap.read()
             
-            if ret:
-                ret, buffer = cv2.imencode('.jpg', frame)
-                if ret:
-                    return base64.b64encode(buffer).decode('utf-8')
-            
-            return None
+            return frame if ret else None
         except Exception as e:
             print(f"Error extracting frame: {str(e)}")
             return None
         finally:
-            cap.release()
+            if cap is not None:
+                cap.release()
 
-    def get_hyperobject_description(self, base64_image, video_data):
-        """Generate description using GPT-4o"""
+    def read_contact_sheet(self, video_path, count=4, samples=32, thumb_width=480):
+        """Tile the most representative frames of a video into one image
+        
+        The video is decoded in a single sequential pass. Only every n-th frame (about
+        `samples` in total) is converted and downscaled to `thumb_width`, the samples
+        are scored with score_frames() and the best `count` are tiled in temporal order.
+        """
+        cap = None
         try:
-            prompt = f"""
-            Observa los presentes en esta imagen.
+            cap = cv2.VideoCapture(str(video_path))
+            if not cap.isOpened():
+                return None
 
-            Genera una descripción que:
-            1. Identifique y describa objetos, formas o elementos específicos visibles en la imagen
-            2. Presente estos elementos de manera difusa o creativa, sugiriendo múltiples interpretaciones posibles
-            3. Mantenga un balance entre lo concreto de los elementos observados y lo difuso de su interpretación, relacionándolo con la categoría '{video_data.get('category', 'desconocida')}'
-            
-            No hagas mención de la imagen solo escribe la idea.
-            """
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            stride = max(1, total_frames // samples)
+            thumbs = []
+            index = 0
+            while len(thumbs) < samples and cap.grab():
+                if index % stride == 0:
+                    ret, frame = cap.retrieve()
+                    if ret:
+                        height = round(frame.shape[0] * thumb_width / frame.shape[1])
+                        thumbs.append(cv2.resize(frame, (thumb_width, height), interpolation=cv2.INTER_AREA))
+                index += 1
+
+            if not thumbs:
+                return None
+            stack = np.stack(thumbs)
+            picked = pick_frames(score_frames(stack), min(count, len(thumbs)))
+            return tile_frames(stack[picked])
+        except Exception as e:
+            print(f"Error extracting frames: {str(e)}")
+            return None
+        finally:
+            if cap is not None:
+                cap.release()
+
+    def encode_frame(self, frame):
+        """Base64 JPEG of a frame within the payload budget (see PayloadBudget.encode)"""
+        return self.budget.encode(frame)
+
+    def load_frame(self, video_data):
+        """
+        Decode the frame to describe for a video and look it up in the response cache.
+
+        Returns:
+            tuple: (frame or None, cached description or None, cache key or None)
+        """
+        video_path = self.root_dir / video_data['path']
+        if self.frames > 1:
+            frame = self.read_contact_sheet(video_path, self.frames, self.samples)
+        else:
+            frame = self.read_middle_frame(video_path, self.keyframes.get(video_data['path']))
+        if frame is None or self.cache is None:
+            return frame, None, None
+
+        category = video_data.get('category', 'desconocida')
+        if category not in self.cache_context:
+            self.cache_context[category] = ResponseCache.context(category, {
+                'model': self.MODEL, 'max_tokens': self.MAX_TOKENS, 'temperature': self.TEMPERATURE,
+                'frames': self.frames, 'detail': self.budget.detail
+            })
+        identity = video_data.get('fingerprint') or video_data['path']
+        cache_key = (self.cache_context[category], self.cache.frame_key(frame, identity))
+        return frame, self.cache.get(*cache_key), cache_key
+
+    def image_part(self, base64_image):
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{base64_image}",
+                "detail": self.budget.detail
+            }
+        }
 
+    def build_messages(self, base64_image, video_data):
+        """Chat messages asking for the description of one video frame"""
+        prompt = PROMPT_TEMPLATE.format(category=video_data.get('category', 'desconocida'))
+        if self.frames > 1:
+            prompt += CONTACT_SHEET_NOTE
+
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    self.image_part(base64_image)
+                ]
+            }
+        ]
+
+    def build_batch_messages(self, base64_images, category):
+        """Chat messages asking for one description per image, identified "1" to "N"
+
+        The prompt is PROMPT_TEMPLATE plus BATCH_NOTE, so batched descriptions follow the
+        same guidance as single ones and share their response cache entries.
+        """
+        prompt = PROMPT_TEMPLATE.format(category=category) + BATCH_NOTE.format(count=len(base64_images))
+        if self.frames > 1:
+            prompt += CONTACT_SHEET_NOTE
+
+        content = [{"type": "text", "text": prompt}]
+        for i, base64_image in enumerate(base64_images, 1):
+            content.append({"type": "text", "text": f"Video {i}"})
+            content.append(self.image_part(base64_image))
+        return [{"role": "user", "content": content}]
+
+    def estimate_tokens(self, messages, image_tokens):
+        """Upper bound on the tokens a request counts against the limit (prompt, image and max_tokens)"""
+        text_tokens = 0
+        for message in messages:
+            for part in message['content']:
+                if part['type'] == 'text':
+                    text_tokens += len(part['text']) // 4
+        return text_tokens + image_tokens + self.MAX_TOKENS
+
+    def log_request(self, videos, payloads, usage, latency):
+        """Print and accumulate the bytes, tokens and latency of one request (of one or more videos)"""
+        record = {
+            'paths': [video_data['path'] for video_data in videos],
+            'bytes': sum(payload['bytes'] for payload in payloads),
+            'quality': [payload['quality'] for payload in payloads],
+            'size': [[payload['width'], payload['height']] for payload in payloads],
+            'detail': self.budget.detail,
+            'image_tokens': sum(payload['image_tokens'] for payload in payloads),
+            'prompt_tokens': usage['prompt_tokens'],
+            'completion_tokens': usage['completion_tokens'],
+            'latency': round(latency, 3)
+        }
+        for key in ('bytes', 'image_tokens', 'prompt_tokens', 'completion_tokens', 'latency'):
+            self.totals[key] += record[key]
+        self.totals['requests'] += 1
+        label = videos[0]['path'] if len(videos) == 1 else f"{len(videos)} videos ({videos[0]['path']}, ...)"
+        print(f"Request {label}: {record['bytes'] / 1024:.0f} KiB "
+              f"({', '.join(f'{w}x{h}' for w, h in record['size'])} "
+              f"q{'/'.join(map(str, record['quality']))} {self.budget.detail}), "
+              f"{usage['prompt_tokens']} prompt + {usage['completion_tokens']} completion tokens, {latency:.2f}s")
+        if self.request_log:
+            with open(self.request_log, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def report_totals(self):
+        requests = self.totals['requests']
+        if not requests:
+            return
+        print(f"Requests: {requests}, {self.totals['bytes'] / 1048576:.1f} MiB sent "
+              f"({self.totals['bytes'] / requests / 1024:.0f} KiB/request), "
+              f"{self.totals['prompt_tokens']} prompt + {self.totals['completion_tokens']} completion tokens "
+              f"({self.totals['prompt_tokens'] / requests:.0f} prompt tokens/request), "
+              f"{self.totals['latency'] / requests:.2f}s mean latency")
+
+    def get_hyperobject_description(self, base64_image, video_data):
+        """Generate description using GPT-4o
+
+        Returns:
+            tuple: (description, usage dict with prompt/completion tokens and latency),
+                   or (None, None) on error
+        """
+        try:
+            started = time.monotonic()
             response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=8000,
-                temperature=1
+                model=self.MODEL,
+                messages=self.build_messages(base64_image, video_data),
+                max_tokens=self.MAX_TOKENS,
+                temperature=self.TEMPERATURE
             )
+            usage = {
+                'prompt_tokens': response.usage.prompt_tokens if response.usage else 0,
+                'completion_tokens': response.usage.completion_tokens if response.usage else 0,
+                'latency': time.monotonic() - started
+            }
             
-            return response.choices[0].message.content.strip()
+            return response.choices[0].message.content.strip(), usage
             
         except Exception as e:
             print(f"Error generating description: {str(e)}")
-            return None
+            return None, None
+
+    async def request_description(self, backend, limiter, messages, image_tokens, max_retries=5,
+                                  response_format=None):
+        """
+        Send one request through the rate limiter, retrying rate limits (429), server
+        errors (5xx) and connection failures with exponential backoff and jitter.
+        A Retry-After header from the server takes precedence over the backoff.
+
+        Returns:
+            tuple: (description, usage dict with prompt/completion tokens and the latency
+                   of the successful attempt), or (None, None) if the request failed for good
+        """
+        estimated = self.estimate_tokens(messages, image_tokens)
+        for attempt in range(max_retries + 1):
+            await limiter.acquire(estimated)
+            started = time.monotonic()
+            try:
+                text, usage = await backend.complete(
+                    messages, max_tokens=self.MAX_TOKENS, temperature=self.TEMPERATURE,
+                    response_format=response_format)
+            except BackendError as e:
+                if not e.retryable or attempt == max_retries:
+                    print(f"Error generating description: {str(e)}")
+                    return None, None
+                delay = e.retry_after or min(60.0, 2 ** attempt) * random.uniform(0.5, 1.5)
+                print(f"Request failed ({e.status or 'connection'}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            limiter.settle(estimated, usage['prompt_tokens'] + usage['completion_tokens'])
+            return text, dict(usage, latency=time.monotonic() - started)
+        return None, None
+
+    def record_description(self, video_data, description):
+        """Store a description on a video and on any copies with the same contents"""
+        self.by_path[video_data['path']]['texto'] = description
+        for video in self.by_fingerprint.get(video_data.get('fingerprint'), ()):
+            video['texto'] = description
+
+        # Journal every annotation, compact the output now and then
+        self.journal.append(video_data['path'], description, video_data.get('fingerprint'))
+        self.uncompacted += 1
+        if self.uncompacted >= self.compact_every:
+            self.save_current_progress()
+        print(f"\nProcessed: {video_data['path']}")
+        print(f"Description: {description[:100]}...")
 
     def save_current_progress(self):
-        """Save current state of ontology"""
-        with open(self.output_file, 'w', encoding='utf-8') as f:
+        """Compact the journal: save current state of ontology and drop the journal"""
+        if self.cache is not None:
+            self.cache.save()
+        self.journal.sync()
+        tmp_file = str(self.output_file) + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(self.ontology, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.output_file)
+        self.journal.reset()
+        self.uncompacted = 0
 
     def annotate_ontology(self):
         """Process videos and add GPT-4o generated descriptions"""
@@ -107,35 +920,380 @@ class HyperobjectAnnotator:
         
         if not to_process:
             print("All videos have been annotated!")
+            if self.uncompacted:
+                self.save_current_progress()
             return
             
         print(f"Found {len(to_process)} videos to process")
         
-        for video_data in tqdm(to_process, desc="Annotating videos"):
-            video_path = self.root_dir / video_data['path']
-            
-            base64_image = self.extract_middle_frame(video_path)
-            if not base64_image:
-                print(f"Could not extract frame from {video_path}")
+        try:
+            for video_data in tqdm(to_process, desc="Annotating videos"):
+                if 'texto' in video_data:
+                    # Filled in from an identical copy annotated earlier in this run
+                    continue
+                frame, cached, cache_key = self.load_frame(video_data)
+                if frame is None:
+                    print(f"Could not extract frame from {self.root_dir / video_data['path']}")
+                    continue
+                if cached:
+                    self.record_description(video_data, cached)
+                    continue
+
+                payload = self.encode_frame(frame)
+                if not payload:
+                    continue
+                description, usage = self.get_hyperobject_description(payload['image'], video_data)
+                if description:
+                    self.log_request([video_data], [payload], usage, usage['latency'])
+                    if cache_key:
+                        self.cache.put(*cache_key, description)
+                    self.record_description(video_data, description)
+        finally:
+            if self.uncompacted:
+                self.save_current_progress()
+            if self.cache is not None:
+                self.cache.report()
+            self.report_totals()
+
+    async def describe_batch(self, backend, limiter, items, max_retries=5):
+        """
+        Describe several videos of one category with a single request.
+
+        Args:
+            items (list): (video_data, payload, cache_key) tuples
+
+        Returns:
+            list: The items that got no valid description and need a request of their own
+        """
+        videos = [video_data for video_data, _, _ in items]
+        payloads = [payload for _, payload, _ in items]
+        messages = self.build_batch_messages(
+            [payload['image'] for payload in payloads], videos[0].get('category', 'desconocida'))
+        text, usage = await self.request_description(
+            backend, limiter, messages, sum(payload['image_tokens'] for payload in payloads),
+            max_retries, response_format=BATCH_RESPONSE_FORMAT)
+        if text is None:
+            return items
+
+        self.log_request(videos, payloads, usage, usage['latency'])
+        descriptions = parse_batch_response(text, {str(i) for i in range(1, len(items) + 1)})
+        leftover = []
+        for i, (video_data, payload, cache_key) in enumerate(items, 1):
+            description = descriptions.get(str(i))
+            if description is None:
+                leftover.append((video_data, payload, cache_key))
                 continue
-                
-            description = self.get_hyperobject_description(base64_image, video_data)
-            if description:
-                # Find the video in the main ontology and update it
-                for video in self.ontology:
-                    if video['path'] == video_data['path']:
-                        video['texto'] = description
-                        break
-                
-                # Save progress after each successful annotation
+            if cache_key:
+                self.cache.put(*cache_key, description)
+            self.record_description(video_data, description)
+        if leftover:
+            print(f"Batch reply left {len(leftover)} of {len(items)} videos without a valid description, "
+                  f"retrying them one by one")
+        return leftover
+
+    async def annotate_ontology_async(self, concurrency=8, requests_per_minute=500,
+                                      tokens_per_minute=300000, max_retries=5, batch_size=1):
+        """
+        Concurrent version of annotate_ontology.
+
+        Up to `concurrency` requests are in flight at once. Each worker extracts its frames
+        in threads, so decoding overlaps with the requests of the other workers, and
+        every request goes through a shared requests/tokens per minute limiter.
+        Copies with the same fingerprint are requested only once.
+
+        With batch_size > 1 videos of the same category are described `batch_size` at a
+        time with a structured JSON reply; videos the reply leaves out or gets wrong are
+        retried with single requests.
+        """
+        print(f"Starting concurrent annotation with {self.MODEL} ({concurrency} in flight"
+              f"{f', {batch_size} videos per request' if batch_size > 1 else ''})...")
+
+        # One request per distinct content; copies get the description when it is recorded
+        to_process = []
+        seen = set()
+        for video in self.ontology:
+            key = video.get('fingerprint') or video['path']
+            if 'texto' not in video and key not in seen:
+                seen.add(key)
+                to_process.append(video)
+
+        if not to_process:
+            print("All videos have been annotated!")
+            if self.uncompacted:
                 self.save_current_progress()
-                print(f"\nProcessed: {video_data['path']}")
-                print(f"Description: {description[:100]}...")
+            return
+
+        print(f"Found {len(to_process)} videos to process")
+
+        # Units of work: runs of up to batch_size videos of the same category
+        by_category = {}
+        for video in to_process:
+            by_category.setdefault(video.get('category'), []).append(video)
+        chunks = [videos[i:i + batch_size]
+                  for videos in by_category.values()
+                  for i in range(0, len(videos), batch_size)]
+
+        backend = self.backend or OpenAIBackend(model=self.MODEL, base_url=self.base_url)
+        limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        pending = iter(chunks)
+        progress = tqdm(total=len(to_process), desc="Annotating videos")
+
+        async def prepare(video_data):
+            frame, cached, cache_key = await asyncio.to_thread(self.load_frame, video_data)
+            if frame is None:
+                print(f"Could not extract frame from {self.root_dir / video_data['path']}")
+                return None
+            if cached:
+                self.record_description(video_data, cached)
+                return None
+            payload = await asyncio.to_thread(self.encode_frame, frame)
+            return (video_data, payload, cache_key) if payload else None
+
+        async def worker():
+            for chunk in pending:
+                items = [item for item in await asyncio.gather(*(prepare(v) for v in chunk)) if item]
+                if len(items) > 1:
+                    items = await self.describe_batch(backend, limiter, items, max_retries)
+                for video_data, payload, cache_key in items:
+                    description, usage = await self.request_description(
+                        backend, limiter, self.build_messages(payload['image'], video_data),
+                        payload['image_tokens'], max_retries)
+                    if description:
+                        self.log_request([video_data], [payload], usage, usage['latency'])
+                        if cache_key:
+                            self.cache.put(*cache_key, description)
+                        self.record_description(video_data, description)
+                progress.update(len(chunk))
+
+        started = time.monotonic()
+        try:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        finally:
+            progress.close()
+            if self.uncompacted:
+                self.save_current_progress()
+            if self.cache is not None:
+                self.cache.report()
+            self.report_totals()
+        elapsed = time.monotonic() - started
+        print(f"Processed {len(to_process)} videos in {elapsed:.1f}s "
+              f"({len(to_process) / max(elapsed, 1e-6) * 60:.1f} videos/min)")
+
+class SyntheticAnnotator(HyperobjectAnnotator):
+    """Annotator that renders a deterministic 1920x1080 frame per fingerprint instead of decoding videos"""
+
+    def synthetic_frame(self, seed):
+        rng = np.random.default_rng(int(hashlib.sha1(seed.encode('utf-8')).hexdigest()[:8], 16))
+        frame = cv2.resize(rng.integers(0, 256, (9, 16, 3), dtype=np.uint8), (1920, 1080),
+                           interpolation=cv2.INTER_CUBIC)
+        noise = rng.integers(-12, 13, frame.shape, dtype=np.int16)
+        return np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+    def seed_for(self, video_path):
+        path = Path(video_path).relative_to(self.root_dir).as_posix()
+        return self.by_path[path].get('fingerprint') or path
+
+    def read_middle_frame(self, video_path, keyframes=None):
+        return self.synthetic_frame(self.seed_for(video_path))
+
+    def read_contact_sheet(self, video_path, count=4, samples=32, thumb_width=480):
+        seed = self.seed_for(video_path)
+        thumbs = [cv2.resize(self.synthetic_frame(f"{seed}:{i}"), (thumb_width, thumb_width * 9 // 16),
+                             interpolation=cv2.INTER_AREA) for i in range(count)]
+        return tile_frames(thumbs)
+
+async def run_benchmark(videos=459, categories=8, duplicate_rate=0.05, concurrency=8, batch_size=1,
+                        frames=1, interrupt_after=None, latency=0.5, jitter=0.5, error_rate=0.02,
+                        rate_limit_rate=0.02, requests_per_minute=5000, tokens_per_minute=10000000,
+                        seed=0):
+    """
+    Benchmark the annotation pipeline against MockBackend on a synthetic ontology.
+
+    The run is interrupted after `interrupt_after` descriptions (default a third of
+    the videos) as if the process had crashed, skipping the final compaction, and then
+    resumed from the output and journal by a new annotator. Prints throughput,
+    request latency percentiles, bytes sent, and checks that the resumed run annotated
+    every video with its expected description without requesting any video twice.
+    """
+    rng = random.Random(seed)
+    ontology = []
+    for i in range(videos):
+        category = f"CATEGORIA_{i % categories}"
+        # Some entries are copies of an earlier one (same fingerprint)
+        if ontology and rng.random() < duplicate_rate:
+            fingerprint = rng.choice(ontology)['fingerprint']
+        else:
+            fingerprint = hashlib.sha1(f"{seed}:{i}".encode('utf-8')).hexdigest()
+        ontology.append({'path': f"{category}/hor/video_{i:05d}.mp4", 'category': category,
+                         'orientation': 'hor', 'fingerprint': fingerprint})
+    if interrupt_after is None:
+        interrupt_after = videos // 3
+
+    work_dir = Path(tempfile.mkdtemp(prefix='annotator_benchmark_'))
+    try:
+        ontology_file = work_dir / 'ontology_map.json'
+        output_file = work_dir / 'annotated_ontology.json'
+        with open(ontology_file, 'w', encoding='utf-8') as f:
+            json.dump(ontology, f)
+
+        backend = MockBackend(latency=latency, jitter=jitter, error_rate=error_rate,
+                              rate_limit_rate=rate_limit_rate, seed=seed)
+        options = dict(concurrency=concurrency, requests_per_minute=requests_per_minute,
+                       tokens_per_minute=tokens_per_minute, batch_size=batch_size)
+        runs = []
+        elapsed = 0.0
+        interrupted_at = None
+        log = io.StringIO()
+        for run in ('interrupted', 'resumed'):
+            started = time.monotonic()
+            with contextlib.redirect_stdout(log):
+                annotator = SyntheticAnnotator(ontology_file, output_file, backend=backend, cache_file=None,
+                                               frames=frames, request_log=work_dir / f'{run}_requests.ndjson')
+                runs.append(annotator)
+                task = asyncio.create_task(annotator.annotate_ontology_async(**options))
+                while run == 'interrupted' and not task.done():
+                    done = sum('texto' in video for video in annotator.ontology)
+                    if done >= interrupt_after:
+                        interrupted_at = done
+                        # Crash: no final compaction, whatever is not journaled is lost
+                        annotator.save_current_progress = lambda: None
+                        task.cancel()
+                        break
+                    await asyncio.sleep(0.01)
+                await asyncio.gather(task, return_exceptions=True)
+                annotator.journal.close()
+            elapsed += time.monotonic() - started
+
+        # Expected descriptions: what the mock says about each video's encoded frame
+        with contextlib.redirect_stdout(log):
+            reference = SyntheticAnnotator(ontology_file, work_dir / 'reference.json', backend=backend,
+                                           cache_file=None, frames=frames)
+        expected = {}
+        for video in ontology:
+            frame, _, _ = reference.load_frame(video)
+            expected[video['path']] = backend.describe(
+                f"data:image/jpeg;base64,{reference.encode_frame(frame)['image']}")
+
+        with open(output_file, 'r', encoding='utf-8') as f:
+            annotated = json.load(f)
+        requested = []
+        latencies = []
+        for run in ('interrupted', 'resumed'):
+            request_log = work_dir / f'{run}_requests.ndjson'
+            if request_log.exists():
+                with open(request_log, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        record = json.loads(line)
+                        requested.extend(record['paths'])
+                        latencies.append(record['latency'])
+
+        missing = sum('texto' not in video for video in annotated)
+        wrong = sum('texto' in video and video['texto'] != expected[video['path']] for video in annotated)
+        repeated = len(requested) - len(set(requested))
+        sent = sum(annotator.totals['bytes'] for annotator in runs)
+        requests = sum(annotator.totals['requests'] for annotator in runs)
+
+        print(f"{videos} videos ({len({v['fingerprint'] for v in ontology})} distinct), "
+              f"concurrency {concurrency}, batch {batch_size}, frames {frames}")
+        print(f"Mock: {latency:.2f}s latency ±{jitter:.0%}, {error_rate:.1%} server errors, "
+              f"{rate_limit_rate:.1%} rate limits; {backend.calls} calls, {backend.failures} failed")
+        print(f"Throughput: {videos / max(elapsed, 1e-6) * 60:.1f} videos/min ({elapsed:.1f}s, "
+              f"{requests} successful requests)")
+        if latencies:
+            p50, p95 = np.percentile(latencies, [50, 95])
+            print(f"Request latency: p50 {p50:.3f}s, p95 {p95:.3f}s")
+        print(f"Bytes sent: {sent / 1048576:.1f} MiB ({sent / max(requests, 1) / 1024:.0f} KiB/request)")
+        interruption = f"interrupted with {interrupted_at} videos annotated" if interrupted_at else "not interrupted"
+        print(f"Resume: {interruption}, {runs[1].uncompacted_at_start} "
+              f"replayed from the journal; {missing} missing, {wrong} wrong, {repeated} requested twice")
+        ok = missing == 0 and wrong == 0 and repeated == 0
+        print("Resume check: " + ("OK" if ok else "FAILED"))
+        return ok
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
 def main():
+    parser = argparse.ArgumentParser(description='Annotate the video ontology with GPT-4o descriptions')
+    parser.add_argument('--ontology', default='ontology_map.json', help='Ontology JSON to annotate')
+    parser.add_argument('--output', default='annotated_ontology.json', help='Annotated ontology JSON')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Requests in flight at once; above 1 runs the concurrent pipeline')
+    parser.add_argument('--rpm', type=int, default=500, help='Requests per minute limit (concurrent mode)')
+    parser.add_argument('--tpm', type=int, default=300000, help='Tokens per minute limit (concurrent mode)')
+    parser.add_argument('--retries', type=int, default=5,
+                        help='Retries for rate limited or failed requests (concurrent mode)')
+    parser.add_argument('--batch', type=int, default=1,
+                        help='Describe up to N videos of the same category per request (concurrent mode)')
+    parser.add_argument('--base-url', default=None,
+                        help='OpenAI compatible endpoint, e.g. a local stub server')
+    parser.add_argument('--compact-every', type=int, default=50,
+                        help='Rewrite the output JSON from the journal every N descriptions')
+    parser.add_argument('--cache', default='annotation_cache.json', help='Response cache file')
+    parser.add_argument('--no-cache', action='store_true', help='Always request a new description')
+    parser.add_argument('--cache-size', type=int, default=10000, help='Maximum cached descriptions')
+    parser.add_argument('--cache-distance', type=int, default=4,
+                        help='Differing frame hash bits (of 64) still treated as the same frame')
+    parser.add_argument('--frames', type=int, default=1,
+                        help='Send a contact sheet of the N most representative frames instead of the middle frame')
+    parser.add_argument('--samples', type=int, default=32,
+                        help='Frames decoded and scored per video for --frames')
+    parser.add_argument('--max-edge', type=int, default=1024, help='Longest image edge sent, in pixels')
+    parser.add_argument('--target-bytes', type=int, default=150000,
+                        help='JPEG size the encoder searches quality for')
+    parser.add_argument('--detail', choices=['low', 'high'], default='high', help='Image detail tier')
+    parser.add_argument('--request-log', default=None,
+                        help='Append bytes, tokens and latency of every request to this NDJSON file')
+    parser.add_argument('--mock', action='store_true',
+                        help='Use the offline mock backend instead of the API (see the --mock-* options)')
+    parser.add_argument('--benchmark', type=int, metavar='N',
+                        help='Benchmark the pipeline on a synthetic ontology of N videos with the mock backend')
+    parser.add_argument('--categories', type=int, default=8, help='Categories of the synthetic ontology')
+    parser.add_argument('--interrupt-after', type=int, default=None,
+                        help='Descriptions before the benchmark simulates a crash (default a third)')
+    parser.add_argument('--mock-latency', type=float, default=0.5, help='Mock response latency in seconds')
+    parser.add_argument('--mock-jitter', type=float, default=0.5, help='Mock latency spread (fraction)')
+    parser.add_argument('--mock-error-rate', type=float, default=0.02, help='Fraction of mock 500 responses')
+    parser.add_argument('--mock-rate-limit-rate', type=float, default=0.02,
+                        help='Fraction of mock 429 responses')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        ok = asyncio.run(run_benchmark(
+            videos=args.benchmark, categories=args.categories, concurrency=args.concurrency,
+            batch_size=args.batch, frames=args.frames, interrupt_after=args.interrupt_after,
+            latency=args.mock_latency, jitter=args.mock_jitter, error_rate=args.mock_error_rate,
+            rate_limit_rate=args.mock_rate_limit_rate, requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm
+        ))
+        raise SystemExit(0 if ok else 1)
+
+    backend = None
+    if args.mock:
+        backend = MockBackend(latency=args.mock_latency, jitter=args.mock_jitter,
+                              error_rate=args.mock_error_rate, rate_limit_rate=args.mock_rate_limit_rate)
+
     try:
-        annotator = HyperobjectAnnotator()
-        annotator.annotate_ontology()
+        annotator = HyperobjectAnnotator(args.ontology, args.output, backend=backend, base_url=args.base_url,
+                                         compact_every=args.compact_every,
+                                         cache_file=None if args.no_cache else args.cache,
+                                         cache_size=args.cache_size,
+                                         cache_distance=args.cache_distance,
+                                         frames=args.frames,
+                                         samples=args.samples,
+                                         budget=PayloadBudget(max_edge=args.max_edge,
+                                                              target_bytes=args.target_bytes,
+                                                              detail=args.detail),
+                                         request_log=args.request_log)
+        if args.concurrency > 1 or args.batch > 1 or backend is not None:
+            asyncio.run(annotator.annotate_ontology_async(
+                concurrency=args.concurrency,
+                requests_per_minute=args.rpm,
+                tokens_per_minute=args.tpm,
+                max_retries=args.retries,
+                batch_size=args.batch
+            ))
+        else:
+            annotator.annotate_ontology()
     except Exception as e:
         print(f"An error occurred: {str(e)}")
 
@@ -1,81 +1,404 @@
 import json
-from collections import defaultdict
-from typing import Dict, List
-import statistics
+import time
+import argparse
+from typing import Dict
+import numpy as np
+from ontology_store import (load_ontology, BinaryOntology, NO_STRING, build_stats, write_stats,
+                            ontology_hash, stats_path)
+
+# Labels of entries without a category, orientation or video type
+UNCATEGORIZED = 'uncategorized'
+UNKNOWN = 'unknown'
+
+class OntologyColumns:
+    """
+    Ontology reduced to the columns the cartography needs: category, orientation and
+    video type as interned integer codes, and duration in seconds.
+
+    Binary ontologies are viewed straight from their memory-mapped records without
+    decoding a single entry; JSON ontologies are interned in one pass.
+    """
+    def __init__(self, strings, category, orientation, video_type, duration):
+        self.strings = strings
+        self.category = category
+        self.orientation = orientation
+        self.video_type = video_type
+        self.duration = duration
+
+    @classmethod
+    def from_videos(cls, videos):
+        interned = {}
+
+        def intern(value):
+            if value is None:
+                return NO_STRING
+            return interned.setdefault(value, len(interned))
+
+        codes = np.array([(intern(video.get('category')),
+                           intern(video.get('orientation')),
+                           intern(video.get('video_type'))) for video in videos],
+                         dtype=np.uint16).reshape(-1, 3)
+        duration = np.fromiter((video.get('duration', 0) for video in videos),
+                               dtype=np.float64, count=len(videos))
+        return cls(list(interned), codes[:, 0], codes[:, 1], codes[:, 2], duration)
+
+    @classmethod
+    def from_binary(cls, ontology):
+        records = ontology.columns()
+        return cls(ontology.strings, records['category'], records['orientation'],
+                   records['video_type'], records['duration'])
+
+    @classmethod
+    def from_ontology(cls, videos):
+        if isinstance(videos, BinaryOntology):
+            return cls.from_binary(videos)
+        return cls.from_videos(videos)
+
+    def __len__(self):
+        return len(self.duration)
+
+    def string(self, code):
+        return None if code == NO_STRING else self.strings[code]
+
+def aggregate(columns):
+    """
+    Group-by of an ontology into per category statistics, with grouped NumPy reductions.
+
+    The (category, orientation, video type) buckets are found with one np.unique over
+    packed codes, their counts and durations with bincount, and the duration min/sum/max
+    of each category with reduceat over the durations sorted by category. Only the
+    resulting groups are walked in Python.
+
+    Returns:
+        dict: category -> {'count', 'total_duration', 'duration_sum', 'duration_min',
+              'duration_max', 'orientations': {orientation -> {'count', 'total_duration',
+              'types': {video type -> {'count', 'total_duration'}}}}}, with categories,
+              orientations and types in order of first appearance in the ontology;
+              entries without a category are grouped under UNCATEGORIZED and those
+              without an orientation or video type under UNKNOWN
+    """
+    categories = {}
+    if not len(columns):
+        return categories
+
+    keys = ((columns.category.astype(np.int64) << 32)
+            | (columns.orientation.astype(np.int64) << 16)
+            | columns.video_type.astype(np.int64))
+    bucket_keys, first, inverse, counts = np.unique(
+        keys, return_index=True, return_inverse=True, return_counts=True)
+    durations = np.bincount(inverse, weights=columns.duration, minlength=len(bucket_keys))
+
+    order = np.argsort(columns.category, kind='stable')
+    category_codes, starts = np.unique(columns.category[order], return_index=True)
+    sorted_durations = columns.duration[order]
+    per_category = {
+        int(code): (float(low), float(total), float(high))
+        for code, low, total, high in zip(
+            category_codes,
+            np.minimum.reduceat(sorted_durations, starts),
+            np.add.reduceat(sorted_durations, starts),
+            np.maximum.reduceat(sorted_durations, starts))
+    }
+
+    def label(code, default):
+        value = columns.string(code)
+        return default if value is None else value
+
+    # Category codes already folded into their category's duration stats (a missing
+    # category and a literal UNCATEGORIZED share one label)
+    folded = set()
+    for i in np.argsort(first, kind='stable'):
+        key = int(bucket_keys[i])
+        category_code = key >> 32
+        category = label(category_code, UNCATEGORIZED)
+        orientation = label((key >> 16) & 0xFFFF, UNKNOWN)
+        video_type = label(key & 0xFFFF, UNKNOWN)
+        count = int(counts[i])
+        duration = float(durations[i])
+
+        if category_code not in folded:
+            folded.add(category_code)
+            low, total, high = per_category[category_code]
+            if category in categories:
+                category_data = categories[category]
+                category_data['duration_sum'] += total
+                category_data['duration_min'] = min(category_data['duration_min'], low)
+                category_data['duration_max'] = max(category_data['duration_max'], high)
+            else:
+                categories[category] = {
+                    'count': 0,
+                    'total_duration': 0,
+                    'duration_sum': total,
+                    'duration_min': low,
+                    'duration_max': high,
+                    'orientations': {}
+                }
+        category_data = categories[category]
+        orient_data = category_data['orientations'].setdefault(
+            orientation, {'count': 0, 'total_duration': 0, 'types': {}})
+        type_data = orient_data['types'].setdefault(video_type, {'count': 0, 'total_duration': 0})
+        type_data['count'] += count
+        type_data['total_duration'] += duration
+        orient_data['count'] += count
+        orient_data['total_duration'] += duration
+        category_data['count'] += count
+        category_data['total_duration'] += duration
+
+    return categories
+
+def iter_ontology_records(json_file, chunk_size=1 << 16):
+    """
+    Yield the entries of an ontology file one at a time without loading the file.
+
+    Reads either a JSON array (ontology_map.json), decoded element by element with
+    raw_decode over a sliding buffer, or NDJSON with one entry per line (the mapper's
+    --stream file); the format is taken from the first non-blank character. A
+    truncated last NDJSON line is ignored.
+    """
+    decoder = json.JSONDecoder()
+    with open(json_file, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size)
+        start = len(buffer) - len(buffer.lstrip())
+        while start == len(buffer):
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buffer = chunk
+            start = len(buffer) - len(buffer.lstrip())
+
+        if buffer[start] != '[':
+            # NDJSON: let the file object do the line splitting
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+            return
+
+        pos = start + 1
+        eof = False
+        while True:
+            # Skip separators between elements
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                if pos == len(buffer):
+                    raise json.JSONDecodeError("Buffer exhausted", buffer, pos)
+                video, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Element cut by the end of the buffer: read more
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield video
+
+class P2Quantile:
+    """
+    Streaming estimate of one quantile with the P-square algorithm (Jain and Chlamtac):
+    five markers whose heights are adjusted with piecewise-parabolic interpolation,
+    so memory is constant however many values are added.
+    """
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, value):
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = next(i for i in range(4) if heights[i] <= value < heights[i + 1])
+        for i in range(cell + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            offset = self.desired[i] - self.positions[i]
+            if ((offset >= 1 and self.positions[i + 1] - self.positions[i] > 1)
+                    or (offset <= -1 and self.positions[i - 1] - self.positions[i] < -1)):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self._linear(i, step)
+                heights[i] = height
+                self.positions[i] += step
+
+    def _parabolic(self, i, step):
+        n, q = self.positions, self.heights
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def _linear(self, i, step):
+        n, q = self.positions, self.heights
+        return q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+
+    def value(self):
+        if not self.heights:
+            return 0
+        if len(self.heights) < 5:
+            # Exact quantile of the few values seen so far
+            return self.heights[min(len(self.heights) - 1, int(self.p * len(self.heights)))]
+        return self.heights[2]
+
+def aggregate_stream(records, quantiles=()):
+    """
+    Same aggregation as aggregate(), computed over an iterable of entries in one pass
+    with running counts, sums and min/max, so memory depends on the number of groups
+    and not on the number of entries.
+
+    Args:
+        records (iterable): Ontology entries, e.g. from iter_ontology_records()
+        quantiles (sequence): Duration quantiles (e.g. 0.5, 0.9) to estimate per category
+                              with P2Quantile, stored under 'duration_quantiles'
+
+    Entries are counted as they come: a stream with several entries for one path (an
+    uncompacted mapper stream) counts each of them.
+    """
+    categories = {}
+    for video in records:
+        duration = video.get('duration', 0)
+        category = video.get('category')
+        if category is None:
+            category = UNCATEGORIZED
+        category_data = categories.get(category)
+        if category_data is None:
+            category_data = categories[category] = {
+                'count': 0,
+                'total_duration': 0,
+                'duration_sum': 0,
+                'duration_min': duration,
+                'duration_max': duration,
+                'orientations': {}
+            }
+            if quantiles:
+                category_data['duration_quantiles'] = {q: P2Quantile(q) for q in quantiles}
+        orientation = video.get('orientation')
+        video_type = video.get('video_type')
+        orient_data = category_data['orientations'].setdefault(
+            UNKNOWN if orientation is None else orientation, {'count': 0, 'total_duration': 0, 'types': {}})
+        type_data = orient_data['types'].setdefault(
+            UNKNOWN if video_type is None else video_type, {'count': 0, 'total_duration': 0})
+
+        type_data['count'] += 1
+        type_data['total_duration'] += duration
+        orient_data['count'] += 1
+        category_data['count'] += 1
+        category_data['duration_sum'] += duration
+        category_data['duration_min'] = min(category_data['duration_min'], duration)
+        category_data['duration_max'] = max(category_data['duration_max'], duration)
+        for sketch in category_data.get('duration_quantiles', {}).values():
+            sketch.add(duration)
+
+    # Orientation and category totals add up the per-type sums, as aggregate() does
+    for category_data in categories.values():
+        for orient_data in category_data['orientations'].values():
+            for type_data in orient_data['types'].values():
+                orient_data['total_duration'] += type_data['total_duration']
+                category_data['total_duration'] += type_data['total_duration']
+    return categories
 
 class OntologyCartographer:
-    def __init__(self, json_file='ontology_map.json'):
-        """Initialize cartographer with ontology data"""
-        with open(json_file, 'r', encoding='utf-8') as f:
-            self.data = json.load(f)
+    def __init__(self, json_file='ontology_map.json', stream=False, quantiles=()):
+        """Initialize cartographer with ontology data
+        
+        With stream=True the ontology (JSON array or NDJSON) is aggregated while it is
+        read, entry by entry, instead of being loaded; quantiles adds streaming duration
+        quantiles per category to the diagram.
+        """
+        self.json_file = json_file
+        if stream or quantiles:
+            self.data = None
+            self.columns = None
+            self.categories = aggregate_stream(iter_ontology_records(json_file), quantiles)
+            return
+
+        self.data = load_ontology(json_file)
+        self.columns = OntologyColumns.from_ontology(self.data)
         
         self.categories = self._organize_by_category()
 
     def _organize_by_category(self) -> Dict:
-        """Organize videos by category with orientation and video type stats"""
-        categories = defaultdict(lambda: {
-            'videos': [],
-            'orientations': defaultdict(lambda: {
-                'videos': [],
-                'types': defaultdict(list)
-            }),
-            'total_duration': 0,
-            'count': 0
-        })
-        
-        for video in self.data:
-            category = video.get('category', 'uncategorized')
-            orientation = video.get('orientation', 'unknown')
-            video_type = video.get('video_type', 'unknown')
-            
-            categories[category]['videos'].append(video)
-            categories[category]['orientations'][orientation]['videos'].append(video)
-            categories[category]['orientations'][orientation]['types'][video_type].append(video)
-            categories[category]['total_duration'] += video.get('duration', 0)
-            categories[category]['count'] += 1
-            
-        return categories
+        """Aggregate counts and durations by category, orientation and video type"""
+        return aggregate(self.columns)
+
+    def save_stats(self, stats_file=None):
+        """Write the per-bucket and per-node playback stats sidecar read by the players"""
+        buckets = [
+            (category, orientation, video_type, type_data['count'], type_data['total_duration'])
+            for category, category_data in self.categories.items()
+            for orientation, orient_data in category_data['orientations'].items()
+            for video_type, type_data in orient_data['types'].items()
+        ]
+        stats_file = stats_file or stats_path(self.json_file)
+        write_stats(build_stats(buckets, ontology_hash(self.json_file)), stats_file)
+        print(f"Stats sidecar saved to {stats_file}")
 
     def get_category_stats(self, category_data: Dict) -> Dict:
         """Calculate statistics for a category"""
         # Calculate stats for each orientation and its video types
         orientations = {}
         for orient, orient_data in category_data['orientations'].items():
-            # Calculate duration for this orientation
-            orient_duration = sum(video.get('duration', 0) for video in orient_data['videos'])
+            # Duration for this orientation
+            orient_duration = orient_data['total_duration']
             
             # Calculate stats for each video type within this orientation
             type_stats = {}
-            for vid_type, videos in orient_data['types'].items():
-                type_duration = sum(video.get('duration', 0) for video in videos)
+            for vid_type, type_data in orient_data['types'].items():
+                type_duration = type_data['total_duration']
                 type_stats[vid_type] = {
-                    'count': len(videos),
+                    'count': type_data['count'],
                     'duration_sec': round(type_duration, 2),
                     'duration_min': round(type_duration / 60, 2)
                 }
             
             orientations[orient] = {
-                'count': len(orient_data['videos']),
+                'count': orient_data['count'],
                 'duration_sec': round(orient_duration, 2),
                 'duration_min': round(orient_duration / 60, 2),
                 'types': type_stats
             }
         
         # Calculate duration stats (min, mean, max)
-        durations = [video.get('duration', 0) for video in category_data['videos']]
         duration_stats = (
-            round(min(durations), 2),
-            round(statistics.mean(durations), 2),
-            round(max(durations), 2)
-        ) if durations else (0, 0, 0)
+            round(category_data['duration_min'], 2),
+            round(category_data['duration_sum'] / category_data['count'], 2),
+            round(category_data['duration_max'], 2)
+        ) if category_data['count'] else (0, 0, 0)
         
-        return {
+        stats = {
             'total_videos': category_data['count'],
             'total_duration': round(category_data['total_duration'], 2),
             'total_duration_min': round(category_data['total_duration'] / 60, 2),
             'duration_stats': duration_stats,
             'orientations': orientations
         }
+        if 'duration_quantiles' in category_data:
+            stats['duration_quantiles'] = {
+                q: round(sketch.value(), 2) for q, sketch in category_data['duration_quantiles'].items()
+            }
+        return stats
 
     def print_tree(self, output_file='cartography_diagram.txt'):
         """Print the ontology tree with statistics and save to file"""
@@ -108,6 +431,10 @@ class OntologyCartographer:
             output.append(f"├── Videos: {stats['total_videos']}")
             output.append(f"├── Duration: {stats['total_duration']} seconds ({stats['total_duration_min']} minutes)")
             output.append(f"├── Duration Min/Mean/Max: {stats['duration_stats']} seconds")
+            if 'duration_quantiles' in stats:
+                quantiles = stats['duration_quantiles']
+                labels = '/'.join(f"P{q * 100:g}" for q in quantiles)
+                output.append(f"├── Duration {labels}: {tuple(quantiles.values())} seconds")
             
             output.append("└── Orientations:")
             orientations = stats['orientations']
@@ -134,10 +461,74 @@ class OntologyCartographer:
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write(clean_text)
 
+def benchmark(sizes=(100000, 1000000), categories=16, seed=0):
+    """
+    Time the aggregation on synthetic ontologies of the given sizes, loaded from a
+    list of entries and from a binary ontology.
+    """
+    import os
+    import tempfile
+    from ontology_store import write_binary_ontology
+
+    rng = np.random.default_rng(seed)
+    orientations = ['hor', 'ver']
+    video_types = ['animated', 'text']
+    for size in sizes:
+        category_codes = rng.integers(0, categories, size)
+        orient_codes = rng.integers(0, len(orientations), size)
+        type_codes = rng.integers(0, len(video_types), size)
+        durations = np.round(rng.uniform(2, 30, size), 2)
+        videos = [{
+            'path': f"CAT_{c}/{orientations[o]}/{video_types[t]}/video_{i}.mp4",
+            'category': f"CAT_{c}",
+            'orientation': orientations[o],
+            'video_type': video_types[t],
+            'duration': float(d)
+        } for i, (c, o, t, d) in enumerate(zip(category_codes, orient_codes, type_codes, durations))]
+
+        start = time.perf_counter()
+        columns = OntologyColumns.from_videos(videos)
+        from_list = time.perf_counter() - start
+        start = time.perf_counter()
+        aggregate(columns)
+        aggregation = time.perf_counter() - start
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bin_file = os.path.join(tmp_dir, 'ontology_map.bin')
+            write_binary_ontology(videos, bin_file)
+            start = time.perf_counter()
+            ontology = BinaryOntology(bin_file)
+            aggregate(OntologyColumns.from_binary(ontology))
+            from_binary = time.perf_counter() - start
+            ontology.close()
+
+        print(f"{size} records: columns from entries {from_list:.3f}s, aggregation {aggregation:.3f}s, "
+              f"binary ontology load + aggregation {from_binary:.3f}s")
+
 def main():
+    parser = argparse.ArgumentParser(description='Hyperobject ontology cartography')
+    parser.add_argument('--input', default='ontology_map.json', help='Ontology file')
+    parser.add_argument('--output', default='cartography_diagram.txt', help='Diagram text file')
+    parser.add_argument('--stream', action='store_true',
+                        help='Aggregate the JSON or NDJSON ontology while reading it, in constant memory')
+    parser.add_argument('--quantiles', type=float, nargs='+', default=(), metavar='Q',
+                        help='Also estimate these duration quantiles per category (e.g. 0.5 0.9); implies --stream')
+    parser.add_argument('--no-stats', action='store_true',
+                        help='Do not write the <ontology>_stats.json sidecar used by the players')
+    parser.add_argument('--benchmark', type=int, nargs='*', metavar='N',
+                        help='Benchmark the aggregation on synthetic ontologies of N records '
+                             '(default 100000 and 1000000)')
+    args = parser.parse_args()
+
+    if args.benchmark is not None:
+        benchmark(args.benchmark or (100000, 1000000))
+        return
+
     try:
-        cartographer = OntologyCartographer()
-        cartographer.print_tree()
+        cartographer = OntologyCartographer(args.input, stream=args.stream, quantiles=args.quantiles)
+        cartographer.print_tree(args.output)
+        if not args.no_stats:
+            cartographer.save_stats()
     except FileNotFoundError:
         print("Error: ontology_map.json not found. Please run ontology_maper.py first.")
     except json.JSONDecodeError:
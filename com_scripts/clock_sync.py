@@ -0,0 +1,205 @@
+"""
+Master-slave clock synchronization over OSC.
+
+The master's time.time() is the reference clock. Each slave sends /sync/ping with a
+sequence number to the master, which answers /sync/pong with the time it received the
+ping (t2) and the time it answered (t3). Together with the slave's send (t1) and
+receive (t4) times this is the NTP on-wire exchange:
+
+    offset = ((t2 - t1) + (t3 - t4)) / 2      master clock minus slave clock
+    delay  = (t4 - t1) - (t3 - t2)            network round trip
+
+Of the last few samples, those delayed well beyond the fastest round trip (queueing
+on the network or in a busy OSC thread) are discarded and the median offset of the
+rest is the estimate. The slave clock follows the estimate by slewing at a bounded
+rate, so scheduled start times never jump; only a large error (at start-up or after
+the master restarts) is stepped.
+
+OSC floats are single precision, so times go over the wire as whole seconds and
+microseconds (split_time / join_time).
+"""
+import time
+import itertools
+from collections import deque
+from threading import Lock, Thread, Event
+
+# Port the master listens on for slave messages
+MASTER_PORT = 8000
+
+# Seconds between pings once synchronized, and during the initial burst
+SYNC_INTERVAL = 2.0
+BURST_INTERVAL = 0.2
+# Number of recent samples the estimate is computed from
+SYNC_SAMPLES = 8
+# Samples whose round trip exceeds OUTLIER_FACTOR times the fastest one plus
+# OUTLIER_MARGIN seconds are discarded
+OUTLIER_FACTOR = 1.5
+OUTLIER_MARGIN = 0.002
+# Maximum correction applied to the slave clock per second, and the error above
+# which the clock is stepped instead of slewed
+SLEW_RATE = 0.001
+STEP_THRESHOLD = 0.05
+
+
+def split_time(value):
+    """Split a time in seconds into (whole seconds, microseconds) OSC integers."""
+    seconds = int(value)
+    return seconds, int(round((value - seconds) * 1000000))
+
+
+def join_time(seconds, microseconds):
+    """Inverse of split_time()."""
+    return seconds + microseconds / 1000000
+
+
+class ClockServer:
+    """Master side: answers /sync/ping on an OSC server with its receive and send times."""
+
+    def __init__(self, server, sock=None, clock=time.time):
+        self.server = server
+        self.clock = clock
+        server.bind(b'/sync/ping', self.handle_ping, sock=sock)
+
+    def handle_ping(self, seq):
+        """Answer a ping with t2 and t3"""
+        received = self.clock()
+        # Look the sender up before t3: get_sender() walks the stack and is slow
+        sock, address, port = self.server.get_sender()
+        sent = self.clock()
+        self._send(sock, address, port, [seq, *split_time(received), *split_time(sent)])
+
+    def _send(self, sock, address, port, values):
+        """Send the pong (overridden by tests to inject network delay)"""
+        self.server.send_message(b'/sync/pong', values, address, port, sock=sock)
+
+
+class ClockSync:
+    """
+    Slave side: estimates the offset of the master clock from periodic pings.
+
+    Pings are sent from the slave's OSC server socket so the pongs come back to it.
+    offset and error are available at any time; time() is the local clock corrected
+    by the slewed offset, i.e. the slave's estimate of the master's time.time().
+    """
+
+    def __init__(self, server, master_address, master_port=MASTER_PORT, sock=None,
+                 interval=SYNC_INTERVAL, samples=SYNC_SAMPLES, clock=time.time,
+                 slew_rate=SLEW_RATE, step_threshold=STEP_THRESHOLD):
+        self.server = server
+        self.sock = sock
+        self.master_address = master_address
+        self.master_port = master_port
+        self.interval = interval
+        self.clock = clock
+        self.slew_rate = slew_rate
+        self.step_threshold = step_threshold
+
+        self.lock = Lock()
+        self.sequence = itertools.count()
+        self.sent = {}  # Sequence number -> t1
+        self.samples = deque(maxlen=samples)  # (offset, delay)
+        self.target = None  # Latest filtered estimate
+        self.round_trip = None  # Fastest accepted round trip of the latest estimate
+        self.applied = 0.0  # Offset currently applied, slewing towards target
+        self.applied_at = time.monotonic()
+        self.stop_event = Event()
+
+        server.bind(b'/sync/pong', self.handle_pong, sock=sock)
+
+    def start(self):
+        """Start pinging the master in a background thread"""
+        thread = Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.ping()
+            # Fill the sample window quickly at start-up, then settle to the interval
+            burst = len(self.samples) < self.samples.maxlen
+            self.stop_event.wait(BURST_INTERVAL if burst else self.interval)
+
+    def ping(self):
+        """Send one ping to the master"""
+        seq = next(self.sequence)
+        with self.lock:
+            # Pongs that never came back
+            for lost in [s for s in self.sent if s < seq - self.samples.maxlen]:
+                del self.sent[lost]
+            self.sent[seq] = self.clock()
+        self._send([seq])
+
+    def _send(self, values):
+        """Send a ping (overridden by tests to inject network delay)"""
+        self.server.send_message(b'/sync/ping', values, self.master_address, self.master_port,
+                                 sock=self.sock)
+
+    def handle_pong(self, seq, received_s, received_us, sent_s, sent_us):
+        """Record one exchange and update the estimate"""
+        t4 = self.clock()
+        with self.lock:
+            t1 = self.sent.pop(seq, None)
+            if t1 is None:
+                return
+            t2 = join_time(received_s, received_us)
+            t3 = join_time(sent_s, sent_us)
+            self.samples.append((((t2 - t1) + (t3 - t4)) / 2, (t4 - t1) - (t3 - t2)))
+            self._update()
+
+    def _update(self):
+        """Filter the samples into a new target offset (lock held)"""
+        fastest = min(delay for _, delay in self.samples)
+        accepted = sorted(offset for offset, delay in self.samples
+                          if delay <= fastest * OUTLIER_FACTOR + OUTLIER_MARGIN)
+        middle = len(accepted) // 2
+        if len(accepted) % 2:
+            target = accepted[middle]
+        else:
+            target = (accepted[middle - 1] + accepted[middle]) / 2
+
+        self._slew()
+        if self.target is None or abs(target - self.applied) > self.step_threshold:
+            print(f"Clock offset stepped to {target * 1000:+.2f} ms")
+            self.applied = target
+        self.target = target
+        self.round_trip = fastest
+
+    def _slew(self):
+        """Move the applied offset towards the target at most slew_rate per second (lock held)"""
+        now = time.monotonic()
+        if self.target is not None:
+            step = self.slew_rate * (now - self.applied_at)
+            self.applied += max(-step, min(step, self.target - self.applied))
+        self.applied_at = now
+
+    @property
+    def synchronized(self):
+        return self.target is not None
+
+    @property
+    def offset(self):
+        """Seconds to add to the local clock to get the master's time"""
+        with self.lock:
+            self._slew()
+            return self.applied
+
+    @property
+    def error(self):
+        """
+        Bound on the error of offset in seconds: half the fastest round trip (the most
+        an asymmetric path can bias it) plus the correction still being slewed.
+        None until the first exchange.
+        """
+        with self.lock:
+            if self.target is None:
+                return None
+            self._slew()
+            return self.round_trip / 2 + abs(self.target - self.applied)
+
+    def time(self):
+        """The master's time.time(), as estimated by this slave"""
+        return self.clock() + self.offset
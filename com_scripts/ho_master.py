@@ -1,34 +1,151 @@
-import json
 import os
+from ontology_store import (load_ontology, get_bucket_index, clip_duration, load_stats,
+                            MASTER_TEXT_INTERVAL, MASTER_TEXT_OFFSETS)
 import time
+import heapq
+from collections import deque
 from oscpy.client import OSCClient
+from oscpy.server import OSCThreadServer
+from clock_sync import ClockServer, MASTER_PORT, split_time
 import random
 import subprocess
 import argparse
 from queue import Queue, Empty
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 import warnings
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
-def get_absolute_video_path(relative_path):
-    """Convert relative video path to absolute path"""
-    base_dir = '/home/pi/video_player'
-    return os.path.join(base_dir, relative_path)
+BASE_DIR = '/home/pi/video_player'
 
-# Load metadata
-with open('/home/pi/video_player/ontology_map.json', 'r') as f:
-    videos = json.load(f)
-    for video in videos:
-        video['path'] = get_absolute_video_path(video['path'])
+# Load metadata (memory-mapped binary ontology when available, JSON otherwise)
+ONTOLOGY_FILE = os.path.join(BASE_DIR, 'ontology_map.json')
+videos = load_ontology(ONTOLOGY_FILE, base_dir=BASE_DIR)
+
+NODES = ['hor1', 'hor2', 'ver1', 'ver2']
+# Node that shows the text clip while a node waits on a None playlist slot
+PARTNERS = {'hor1': 'hor2', 'hor2': 'hor1', 'ver1': 'ver2', 'ver2': 'ver1'}
+
+# Seconds behind schedule after which a node's timeline restarts instead of catching up
+MAX_SCHEDULE_LAG = 5.0
+
+# Seconds before its start time that a clip is sent, so the slave can open it in advance
+LEAD_TIME = 0.5
+
+# Number of upcoming clips announced to each slave with every play, for prefetching
+LOOKAHEAD = 2
+
+# Seconds without a heartbeat after which a slave is considered down
+FAILURE_WINDOW = 3.0
+
+class NodeMonitor:
+    """
+    Liveness of the slaves, from the /heartbeat messages they send every second.
+
+    A node is down once no heartbeat has arrived for `window` seconds since its last
+    one, and back up with its next heartbeat. Nodes that have never reported (e.g. a
+    slave sending its heartbeats to another --master address) are not tracked: they
+    are never marked down and their plays are not expected to be acknowledged, so
+    they are scheduled as if no monitor were running. A watchdog thread checks every
+    quarter window; each change sets `changed`, which wakes the scheduler. Plays are
+    expected to be acknowledged with /ack within the window, and missing
+    acknowledgements are reported.
+    """
+
+    def __init__(self, server, sock=None, window=FAILURE_WINDOW):
+        self.window = window
+        self.lock = Lock()
+        self.started = time.monotonic()
+        self.last_seen = {}  # Node -> time.monotonic() of its last heartbeat
+        self.status = {}     # Node -> (clip, position, clock offset, clock error)
+        self.unacked = {}    # (node, clip name) -> time.monotonic() the play was sent
+        self.down = set()
+        self.silent_warned = False
+        self.changed = Event()
+        server.bind(b'/heartbeat', self.handle_heartbeat, sock=sock)
+        server.bind(b'/ack', self.handle_ack, sock=sock)
+
+    def start(self):
+        """Start the watchdog thread"""
+        thread = Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _run(self):
+        while True:
+            self.check()
+            time.sleep(self.window / 4)
+
+    def handle_heartbeat(self, node, clip, position, offset, error):
+        node = node.decode()
+        if node not in PARTNERS:
+            return
+        with self.lock:
+            self.last_seen[node] = time.monotonic()
+            self.status[node] = (clip.decode(), position, offset, error)
+            if node in self.down:
+                self.down.discard(node)
+                print(f"\n{node} is back")
+                self.changed.set()
+
+    def handle_ack(self, node, clip):
+        with self.lock:
+            self.unacked.pop((node.decode(), clip.decode()), None)
+
+    def sent(self, node, clip):
+        """Record a play command that the node should acknowledge (once it has reported)"""
+        with self.lock:
+            if node in self.last_seen:
+                self.unacked[(node, clip)] = time.monotonic()
+
+    def check(self):
+        """Mark nodes whose heartbeats stopped as down and report unacknowledged plays"""
+        now = time.monotonic()
+        with self.lock:
+            if not self.silent_warned and now - self.started > self.window:
+                self.silent_warned = True
+                never = [node for node in PARTNERS if node not in self.last_seen]
+                if never:
+                    print(f"\nNo heartbeat yet from {', '.join(never)} (check their --master address); "
+                          f"they are not failed over until they report")
+            for node in PARTNERS:
+                if node not in self.last_seen:
+                    continue
+                silent = now - self.last_seen[node]
+                if silent > self.window and node not in self.down:
+                    self.down.add(node)
+                    clip, position, _, _ = self.status.get(node, ('', 0, 0, 0))
+                    last = f", last playing {clip} at {position:.1f}s" if clip else ""
+                    print(f"\n{node} is down: no heartbeat for {silent:.1f}s{last}")
+                    self.changed.set()
+            for key, sent_at in list(self.unacked.items()):
+                if now - sent_at > self.window:
+                    print(f"{key[0]} did not acknowledge {key[1]}")
+                    del self.unacked[key]
+
+    def down_nodes(self):
+        with self.lock:
+            return set(self.down)
 
 class MasterNode:
-    def __init__(self, local_slave):
+    def __init__(self, local_slave, lead_time=LEAD_TIME, failure_window=FAILURE_WINDOW,
+                 lookahead=LOOKAHEAD):
         print("\n=== Master Node Initialization ===")
         self.local_slave = local_slave  # 'hor1', 'ver1', etc.
+        self.lead_time = lead_time
+        self.lookahead = lookahead
         
-        # Get unique categories in alphabetical order
-        self.categories = sorted(set(video['category'] for video in videos))
+        # Bucket index: (category, orientation, type) -> videos, looked up in O(1)
+        self.buckets = get_bucket_index(videos)
+        
+        # Per-category clip counts and the layout of the synchronized playlists from the
+        # cartography stats sidecar; categories with no clips for any node are skipped
+        self.stats = load_stats(ONTOLOGY_FILE, self.buckets)
+        self.categories = [category for category in self.buckets.categories()
+                           if self.stats['categories'].get(category, {}).get('count')]
         print(f"\nFound {len(self.categories)} categories: {self.categories}")
+        for node, node_stats in self.stats['master'].items():
+            print(f"  {node}: {node_stats['clips']} clips, {node_stats['loop_length']:.1f}s expected loop")
         
         # Initialize OSC clients for each slave
         self.slaves = {
@@ -41,15 +158,20 @@ class MasterNode:
         print("\nInitialized OSC clients:")
         for slave, client in self.slaves.items():
             print(f"  {slave}: {client._address}:{client._port}")
+        
+        # OSC server for slave messages; slaves synchronize their clocks to this node's
+        self.osc_server = OSCThreadServer()
+        self.sock = self.osc_server.listen(address='0.0.0.0', port=MASTER_PORT, default=True)
+        self.clock_server = ClockServer(self.osc_server, self.sock)
+        print(f"Clock reference listening on port {MASTER_PORT}")
+        
+        # Slave heartbeats and acknowledgements
+        self.monitor = NodeMonitor(self.osc_server, self.sock, failure_window)
 
     def organize_videos_by_type(self, category, orientation):
         """Separate videos by type for a given category and orientation"""
-        category_videos = [v for v in videos 
-                         if v['category'] == category 
-                         and v['orientation'].lower() == orientation]
-        
-        animated = [v for v in category_videos if v['video_type'] == 'animated']
-        text = [v for v in category_videos if v['video_type'] == 'text']
+        animated = self.buckets.select(videos, category, orientation, 'animated')
+        text = self.buckets.select(videos, category, orientation, 'text')
         
         return animated, text
 
@@ -81,62 +203,227 @@ class MasterNode:
             playlists[node].append(video)
         
         # Insert text videos at intervals (never simultaneously)
-        text_interval = 3  # Show text video after every 3 animated videos
+        text_interval = MASTER_TEXT_INTERVAL  # Show text video after every 3 animated videos
         
         # Add text videos to horizontal nodes
         for i, text_video in enumerate(hor_text):
-            pos = (i + 1) * text_interval
+            pos = (i + 1) * text_interval + MASTER_TEXT_OFFSETS['hor']
             if pos < len(playlists['hor1']):
                 playlists['hor1'].insert(pos, text_video)
                 playlists['hor2'].insert(pos, None)  # Other node waits
         
         # Add text videos to vertical nodes (offset from horizontal)
         for i, text_video in enumerate(ver_text):
-            pos = (i + 1) * text_interval + 2  # Offset to avoid simultaneous text videos
+            pos = (i + 1) * text_interval + MASTER_TEXT_OFFSETS['ver']  # Offset to avoid simultaneous text videos
             if pos < len(playlists['ver1']):
                 playlists['ver1'].insert(pos, text_video)
                 playlists['ver2'].insert(pos, None)  # Other node waits
         
         return playlists
 
-    def play_video(self, node, video):
-        """Send play command to a specific node"""
+    def play_video(self, node, video, start_time=None, upcoming=()):
+        """
+        Send play command to a specific node.
+
+        With a start_time (time.time() value of this node, the clock the slaves
+        synchronize to) the command goes out as an OSC bundle
+        timetagged with that time, and the start time is also passed in the message
+        as whole seconds and microseconds (OSC floats are single precision, and
+        oscpy does not hand bundle timetags to handlers). The slave opens the clip
+        paused right away and starts presenting it at that instant.
+
+        upcoming lists the (video, start_time) of the clips scheduled after this one;
+        they travel in the same bundle as a /segment message of (name, seconds,
+        microseconds) triples, so the slave can prefetch them.
+        """
         if video is None:
             return
         try:
-            self.slaves[node].send_message(b'/play', [video['name'].encode()])
+            if start_time is None:
+                self.slaves[node].send_message(b'/play', [video['name'].encode()])
+            else:
+                messages = [(b'/play', [video['name'].encode(), 0.0, *split_time(start_time)])]
+                if upcoming:
+                    messages.append((b'/segment', [
+                        value
+                        for next_video, next_start in upcoming
+                        for value in (next_video['name'].encode(), *split_time(next_start))
+                    ]))
+                self.slaves[node].send_bundle(messages, timetag=start_time)
+            self.monitor.sent(node, video['name'])
             print(f"Sent play command to {node}: {video['name']}")
         except Exception as e:
             print(f"Error sending play command to {node}: {e}")
 
+    def node_timeline(self, playlists, node):
+        """
+        Yield (video, duration) for each slot of a node's playlist.
+
+        A None slot is a wait while the partner node shows a text clip at the same
+        position, so it lasts as long as that clip (video is None).
+        """
+        partner = playlists[PARTNERS[node]]
+        for i, video in enumerate(playlists[node]):
+            if video is None:
+                yield None, clip_duration(partner[i]) if i < len(partner) and partner[i] else 0
+            else:
+                yield video, clip_duration(video)
+
+    def peek_slot(self, node, i):
+        """
+        The i-th upcoming (video, duration) slot of a node's timeline (0 is the next
+        one), moving on to the next category when the current one is finished. None
+        past the end of the last category.
+
+        Slots are buffered in self.upcoming[node] until take_slots() consumes them.
+        The playlists of a category are created when the first node reaches it and
+        dropped once every node has moved past it.
+        """
+        buffered = self.upcoming[node]
+        index, timeline = self.position[node]
+        while len(buffered) <= i:
+            slot = next(timeline, None)
+            if slot is not None:
+                buffered.append(slot)
+                continue
+            if index + 1 >= len(self.categories):
+                return None
+            # Node finished its category: move on to the next one
+            index += 1
+            if index not in self.playlists:
+                category = self.categories[index]
+                print(f"\n=== Processing Category: {category} ===")
+                self.playlists[index] = self.create_synchronized_playlist(category)
+            timeline = self.node_timeline(self.playlists[index], node)
+            self.position[node] = (index, timeline)
+            # Drop playlists every node has moved past
+            slowest = min(i for i, _ in self.position.values())
+            for finished in [i for i in self.playlists if i < slowest]:
+                del self.playlists[finished]
+        return buffered[i]
+
+    def plan(self, node, covering, turn, count):
+        """
+        The next `count` slots a node will play, as (source node, buffer index, slot).
+
+        Normally they come from the node's own timeline. A node covering for its down
+        partner alternates between both timelines (turn says whether the partner's
+        goes first) and skips wait slots, falling back to the other timeline when one
+        is finished.
+        """
+        partner = PARTNERS[node]
+        cursor = {node: 0, partner: 0}
+        planned = []
+        while len(planned) < count:
+            sources = [node]
+            if covering:
+                sources = [partner, node] if turn else [node, partner]
+            for source in sources:
+                slot = self.peek_slot(source, cursor[source])
+                while covering and slot is not None and slot[0] is None:
+                    cursor[source] += 1
+                    slot = self.peek_slot(source, cursor[source])
+                if slot is not None:
+                    planned.append((source, cursor[source], slot))
+                    cursor[source] += 1
+                    # After a clip of its own, the covering node plays one of its partner's
+                    turn = source == node
+                    break
+            else:
+                break
+        return planned
+
+    def take_slots(self, source, index):
+        """Consume a timeline's buffered slots up to and including `index`"""
+        for _ in range(index + 1):
+            self.upcoming[source].popleft()
+
     def run(self):
-        """Main execution loop"""
+        """
+        Main execution loop: an event scheduler over per-node deadlines.
+
+        Each node walks the categories on its own timeline and gets its next clip
+        the moment its current clip (or wait slot) ends. A heap of (deadline, node)
+        orders the events; deadlines are time.monotonic() values chained with exact
+        clip durations, so dispatch latency does not accumulate into drift.
+
+        Each clip is sent lead_time seconds before its deadline, timetagged with the
+        deadline, so every display starts at the scheduled instant however long the
+        command takes to arrive.
+
+        A node the monitor reports down is taken out of the heap and its orientation
+        partner alternates between its own playlist and the missing node's (skipping
+        wait slots, since nobody shows the text clips they wait for). When the node
+        is back it rejoins the schedule where its playlist has got to. The show ends
+        once every node that is not down has finished the last category.
+        """
         print("\n=== Starting Video Playback ===")
+        self.monitor.start()
         
         try:
-            # Process each category in alphabetical order
-            for category in self.categories:
-                print(f"\n=== Processing Category: {category} ===")
-                
-                # Create synchronized playlists for this category
-                playlists = self.create_synchronized_playlist(category)
-                
-                # Get maximum playlist length
-                max_length = max(len(playlist) for playlist in playlists.values())
-                
-                # Play videos from playlists
-                for i in range(max_length):
-                    for node in ['hor1', 'hor2', 'ver1', 'ver2']:
-                        if i < len(playlists[node]):
-                            video = playlists[node][i]
-                            if video:
-                                self.play_video(node, video)
-                    
-                    # Wait for videos to finish (approximate)
-                    # In a real implementation, you might want to add synchronization mechanisms
-                    time.sleep(12)  # Adjust based on typical video duration
-                
-                print(f"Finished category: {category}")
+            self.playlists = {}  # Category index -> synchronized playlists
+            self.position = {node: (-1, iter(())) for node in NODES}  # Node -> (category index, timeline)
+            self.upcoming = {node: deque() for node in NODES}  # Node -> slots read ahead of its timeline
+            start = time.monotonic() + self.lead_time
+            heap = [(start, node) for node in NODES]
+            heapq.heapify(heap)
+            parked = set()    # Down nodes, covered by their partners
+            finished = set()  # Nodes past the end of the last category
+            turn = {}         # Covering node -> whether its partner's playlist goes next
+
+            while True:
+                if self.monitor.changed.is_set():
+                    self.monitor.changed.clear()
+                    down = self.monitor.down_nodes()
+                    for node in down - parked:
+                        print(f"{PARTNERS[node]} takes over the playlist of {node}")
+                        parked.add(node)
+                    for node in parked - down:
+                        print(f"{node} rejoins the schedule")
+                        parked.discard(node)
+                        heap.append((time.monotonic() + self.lead_time, node))
+                    heap = [entry for entry in heap if entry[1] not in parked]
+                    heapq.heapify(heap)
+                if not heap:
+                    live = set(NODES) - parked
+                    if live and live <= finished:
+                        # Parked nodes' playlists were played by their partners
+                        print("\n=== All categories played ===")
+                        break
+                    # Every node is down: wait for one to come back
+                    self.monitor.changed.wait()
+                    continue
+
+                deadline, node = heap[0]
+                delay = deadline - self.lead_time - time.monotonic()
+                if delay > 0 and self.monitor.changed.wait(delay):
+                    continue
+                heapq.heappop(heap)
+
+                covering = PARTNERS[node] in parked
+                planned = self.plan(node, covering, turn.get(node, False), 1 + self.lookahead)
+                if not planned:
+                    print(f"{node} finished all categories")
+                    finished.add(node)
+                    continue
+                source, index, (video, duration) = planned[0]
+                self.take_slots(source, index)
+                turn[node] = covering and source == node
+
+                now = time.monotonic()
+                if now + self.lead_time - deadline > MAX_SCHEDULE_LAG:
+                    # Too far behind to catch up: restart this node's timeline
+                    deadline = now + self.lead_time
+                if video is not None:
+                    # Start times of the clips after this one, as the schedule stands
+                    upcoming = []
+                    start = deadline + duration
+                    for _, _, (next_video, next_duration) in planned[1:]:
+                        if next_video is not None:
+                            upcoming.append((next_video, time.time() + start - now))
+                        start += next_duration
+                    self.play_video(node, video, time.time() + deadline - now, upcoming)
+                heapq.heappush(heap, (deadline + duration, node))
                 
         except KeyboardInterrupt:
             print("\nPlayback interrupted by user")
@@ -149,10 +436,16 @@ def main():
     parser.add_argument('--local-slave', required=True, 
                       choices=['hor1', 'ver1'],
                       help='Which slave node runs on this device')
+    parser.add_argument('--lead-time', type=float, default=LEAD_TIME,
+                      help='Seconds before its start time that each clip is sent to its slave')
+    parser.add_argument('--failure-window', type=float, default=FAILURE_WINDOW,
+                      help='Seconds without a heartbeat after which a slave is failed over to its partner')
+    parser.add_argument('--lookahead', type=int, default=LOOKAHEAD,
+                      help='Upcoming clips announced to each slave for prefetching')
     args = parser.parse_args()
     
     try:
-        master = MasterNode(args.local_slave)
+        master = MasterNode(args.local_slave, args.lead_time, args.failure_window, args.lookahead)
         master.run()
     except Exception as e:
         print(f"Error: {e}")
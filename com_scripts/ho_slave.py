@@ -1,24 +1,45 @@
-import json
 import os
+import time
+from ontology_store import load_ontology, get_bucket_index, load_keyframe_index, nearest_keyframe
 import pygame
 from ffpyplayer.player import MediaPlayer
 from oscpy.server import OSCThreadServer
+from clock_sync import ClockSync, join_time, MASTER_PORT
 import argparse
 from queue import Queue, Empty
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 import warnings
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
-def get_absolute_video_path(relative_path):
-    """Convert relative video path to absolute path"""
-    base_dir = '/home/pi/video_player'
-    return os.path.join(base_dir, relative_path)
+BASE_DIR = '/home/pi/video_player'
 
-# Load metadata
-with open('/home/pi/video_player/ontology_map.json', 'r') as f:
-    videos = json.load(f)
-    for video in videos:
-        video['path'] = get_absolute_video_path(video['path'])
+# Seconds between heartbeats to the master
+HEARTBEAT_INTERVAL = 1.0
+
+# Most upcoming clips kept open ahead of their start
+PREFETCH_WINDOW = 3
+
+# Load metadata (memory-mapped binary ontology when available, JSON otherwise)
+videos = load_ontology(os.path.join(BASE_DIR, 'ontology_map.json'), base_dir=BASE_DIR)
+
+# Keyframe timestamps per clip, used to start mid-clip without decoding from the start
+keyframes = {
+    os.path.join(BASE_DIR, path): clip_keyframes
+    for path, clip_keyframes in load_keyframe_index(os.path.join(BASE_DIR, 'ontology_map.json')).items()
+}
+
+def warm_page_cache(path):
+    """Ask the kernel to read a file ahead into the page cache (no-op where unsupported)"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"Could not prefetch {path}: {e}")
 
 class SlavePlayer:
     def __init__(self, orientation):
@@ -29,11 +50,27 @@ class SlavePlayer:
         self.stop_event = Event()
         self.frame_queue = Queue(maxsize=4)
         self.video_queue = Queue()
+        # Scheduled clips: (video name, offset, start time on time.monotonic()), and
+        # the next one opened paused as (video, player, start time)
+        self.schedule_queue = Queue()
+        self.pending = None
+        # Incremented for each started clip; frames of earlier clips are dropped
+        self.generation = 0
+        # Upcoming clips announced by the master, (name, start time on time.monotonic()),
+        # and those opened ahead as name -> (video, player)
+        self.segment_queue = Queue()
+        self.prefetched = {}
+        self.prefetch_lock = Lock()
+        prefetch_thread = Thread(target=self._prefetch_loop)
+        prefetch_thread.daemon = True
+        prefetch_thread.start()
         
-        # Filter videos for this orientation
+        # Look up the videos for this orientation in the bucket index
+        buckets = get_bucket_index(videos)
         self.available_videos = {
-            video['name']: video for video in videos 
-            if video['orientation'].lower() == orientation
+            video['name']: video
+            for category in buckets.categories()
+            for video in buckets.select(videos, category, orientation)
         }
         
         print(f"\nFound {len(self.available_videos)} videos for {orientation} orientation")
@@ -76,18 +113,39 @@ class SlavePlayer:
                 if event.type == pygame.QUIT:
                     return
 
+            # Open scheduled clips paused as soon as they arrive
+            try:
+                video_name, offset, start_at, prefetched = self.schedule_queue.get_nowait()
+                self._prepare_video(video_name, offset, start_at, prefetched)
+            except Empty:
+                pass
+
+            # Use video-specific FPS if available
+            fps = self.current_video.get('fps', 30) if self.current_video else 30
+
+            # Start the prepared clip if its start time falls before the next tick,
+            # sleeping up to that exact instant
+            if self.pending:
+                wait = self.pending[2] - time.monotonic()
+                if wait < 1 / fps:
+                    if wait > 0:
+                        time.sleep(wait)
+                    self._start_pending()
+
             # Check for new video when no video is playing
             if self.current_video is None:
                 try:
-                    video_name = self.video_queue.get_nowait()
-                    self._start_video(video_name)
+                    video_name, offset = self.video_queue.get_nowait()
+                    self._start_video(video_name, offset)
                 except Empty:
                     pass
                 
             # Display frames if available
             try:
-                frame_data = self.frame_queue.get_nowait()
-                if frame_data == "EOF":
+                generation, frame_data = self.frame_queue.get_nowait()
+                if generation != self.generation:
+                    pass  # Left over from a clip that has been replaced
+                elif frame_data == "EOF":
                     self.stop_video()
                 elif isinstance(frame_data, pygame.Surface):
                     self.screen.blit(frame_data, (0, 0))
@@ -95,12 +153,27 @@ class SlavePlayer:
             except Empty:
                 pass
                 
-            # Use video-specific FPS if available
-            fps = self.current_video.get('fps', 30) if self.current_video else 30
             clock.tick(fps)
 
-    def _start_video(self, video_name):
-        """Start playing a video"""
+    def _open_player(self, video, offset=0, paused=False):
+        """Open a clip with ffpyplayer, optionally from `offset` seconds into it and paused"""
+        ff_opts = {'paused': True} if paused else {}
+        if not offset:
+            return MediaPlayer(video['path'], ff_opts=ff_opts)
+        # Open at the keyframe at or before the requested position, which the demuxer
+        # can seek to directly, then seek accurately: the frames between the keyframe
+        # and the offset are decoded and discarded, so playback starts exactly at the
+        # offset instead of up to a GOP early
+        keyframe = nearest_keyframe(keyframes.get(video['path']), offset)
+        ff_opts['ss'] = keyframe
+        player = MediaPlayer(video['path'], ff_opts=ff_opts)
+        if offset > keyframe:
+            player.seek(offset, relative=False, accurate=True)
+        print(f"Resuming at {offset:.3f}s (decoding from keyframe at {keyframe:.3f}s)")
+        return player
+
+    def _start_video(self, video_name, offset=0):
+        """Start playing a video, optionally from `offset` seconds into the clip"""
         if video_name not in self.available_videos:
             print(f"Video not found: {video_name}")
             return
@@ -112,26 +185,123 @@ class SlavePlayer:
             self.stop_video()
             
         try:
-            self.current_video = self.available_videos[video_name]
-            self.stop_event.clear()
-            self.player = MediaPlayer(self.current_video['path'])
-            
-            # Start frame fetching thread
-            fetch_thread = Thread(target=self._fetch_frames)
-            fetch_thread.daemon = True
-            fetch_thread.start()
-            
+            video = self.available_videos[video_name]
+            self._present(video, self._open_player(video, offset))
         except Exception as e:
             print(f"Error starting video: {e}")
             self.stop_video()
 
-    def _fetch_frames(self):
-        """Fetch and convert frames in separate thread"""
-        while not self.stop_event.is_set():
-            frame, val = self.player.get_frame()
+    def _prepare_video(self, video_name, offset, start_at, prefetched=None):
+        """
+        Open a scheduled clip paused so that starting it only means unpausing.
+
+        `prefetched` is the player the prefetch window already opened for the clip,
+        used when the clip starts from the beginning.
+        """
+        if video_name not in self.available_videos:
+            print(f"Video not found: {video_name}")
+            return
+        if self.pending:
+            print(f"Replacing scheduled video {self.pending[0]['name']}")
+            self.pending[1].close_player()
+            self.pending = None
+
+        late = time.monotonic() - start_at
+        if late > 0:
+            # The command arrived after its start time: join the clip where it is now
+            print(f"Scheduled start of {video_name} missed by {late:.3f}s")
+            offset += late
+        if prefetched and not offset:
+            self.pending = (prefetched[0], prefetched[1], start_at)
+            return
+        if prefetched:
+            prefetched[1].close_player()
+        try:
+            video = self.available_videos[video_name]
+            self.pending = (video, self._open_player(video, offset, paused=True), start_at)
+        except Exception as e:
+            print(f"Error preparing video: {e}")
+
+    def take_prefetched(self, video_name):
+        """Remove and return the (video, player) prefetched for a clip, if any"""
+        with self.prefetch_lock:
+            return self.prefetched.pop(video_name, None)
+
+    def _prefetch_loop(self):
+        """Keep the clips of the latest announced segment open, in a background thread"""
+        while True:
+            segment = self.segment_queue.get()
+            # Only the latest segment matters
+            try:
+                while True:
+                    segment = self.segment_queue.get_nowait()
+            except Empty:
+                pass
+            self._prefetch(segment)
+
+    def _prefetch(self, segment):
+        """
+        Make the prefetch window match a segment: the first PREFETCH_WINDOW clips
+        still to come are read ahead into the page cache and opened paused, which
+        opens the demuxer and has the decoder fill its queue with the first frames;
+        clips no longer announced are closed.
+        """
+        now = time.monotonic()
+        names = []
+        for video_name, start_at in sorted(segment, key=lambda entry: entry[1]):
+            if start_at > now and video_name in self.available_videos and video_name not in names:
+                names.append(video_name)
+        names = names[:PREFETCH_WINDOW]
+
+        with self.prefetch_lock:
+            stale = [self.prefetched.pop(name) for name in list(self.prefetched) if name not in names]
+        for _, player in stale:
+            player.close_player()
+
+        for video_name in names:
+            with self.prefetch_lock:
+                if video_name in self.prefetched:
+                    continue
+            video = self.available_videos[video_name]
+            warm_page_cache(video['path'])
+            try:
+                player = self._open_player(video, paused=True)
+            except Exception as e:
+                print(f"Error prefetching video: {e}")
+                continue
+            with self.prefetch_lock:
+                self.prefetched[video_name] = (video, player)
+            print(f"Prefetched {video_name}")
+
+    def _start_pending(self):
+        """Present the prepared clip, replacing the current one"""
+        video, player, start_at = self.pending
+        self.pending = None
+        if self.player:
+            self.stop_video()
+        print(f"\nStarting video: {video['name']} ({(time.monotonic() - start_at) * 1000:+.1f} ms)")
+        player.set_pause(False)
+        self._present(video, player)
+
+    def _present(self, video, player):
+        """Make `player` the current player and start fetching its frames"""
+        self.generation += 1
+        self.current_video = video
+        self.player = player
+        self.stop_event = Event()
+
+        # Start frame fetching thread
+        fetch_thread = Thread(target=self._fetch_frames, args=(player, self.stop_event, self.generation))
+        fetch_thread.daemon = True
+        fetch_thread.start()
+
+    def _fetch_frames(self, player, stop_event, generation):
+        """Fetch and convert frames of one clip in separate thread"""
+        while not stop_event.is_set():
+            frame, val = player.get_frame()
             
             if val == 'eof':
-                self.frame_queue.put("EOF")
+                self.frame_queue.put((generation, "EOF"))
                 break
                 
             if frame is not None:
@@ -143,11 +313,19 @@ class SlavePlayer:
                         "RGB"
                     )
                     surface = pygame.transform.scale(surface, self.screen.get_rect().size)
-                    self.frame_queue.put(surface)
+                    self.frame_queue.put((generation, surface))
                 except Exception as e:
                     print(f"Error processing frame: {e}")
                     continue
 
+    def position(self):
+        """Playback position of the current clip in seconds (0 when idle)"""
+        player = self.player
+        try:
+            return float(player.get_pts()) if player else 0.0
+        except Exception:
+            return 0.0
+
     def stop_video(self):
         """Stop the current video"""
         self.stop_event.set()
@@ -157,10 +335,12 @@ class SlavePlayer:
         self.current_video = None
 
 class SlaveNode:
-    def __init__(self, orientation, node):
+    def __init__(self, orientation, node, master='192.168.1.201'):
         print(f"Initializing slave node {node} with orientation {orientation}")
         self.orientation = orientation
         self.node = node
+        self.name = f"{orientation}{node}"
+        self.master = master
         
         # Initialize video player
         self.player = SlavePlayer(orientation)
@@ -183,6 +363,17 @@ class SlaveNode:
         # Register OSC handlers
         self.osc_server.bind(b'/play', self.handle_play)
         self.osc_server.bind(b'/stop', self.handle_stop)
+        self.osc_server.bind(b'/segment', self.handle_segment)
+        
+        # Estimate of the master clock, which scheduled start times refer to
+        self.clock = ClockSync(self.osc_server, master, sock=self.sock)
+        self.clock.start()
+        print(f"Synchronizing clock with master at {master}")
+        
+        # Heartbeats let the master fail this node over to its partner when it stops
+        heartbeat_thread = Thread(target=self._send_heartbeats)
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
 
     def _get_port(self, orientation, node):
         """Get the correct port based on orientation and node number"""
@@ -191,11 +382,62 @@ class SlaveNode:
         else:
             return 8003 if node == 1 else 8004
 
-    def handle_play(self, video_name):
-        """Handle incoming play command"""
+    def _send_to_master(self, address, values):
+        try:
+            self.osc_server.send_message(address, values, self.master, MASTER_PORT, sock=self.sock)
+        except Exception as e:
+            print(f"Error sending {address.decode()} to master: {e}")
+
+    def _send_heartbeats(self):
+        """Report the current clip, its position and the clock estimate every HEARTBEAT_INTERVAL"""
+        while True:
+            video = self.player.current_video
+            error = self.clock.error
+            self._send_to_master(b'/heartbeat', [
+                self.name.encode(),
+                video['name'].encode() if video else b'',
+                self.player.position(),
+                float(self.clock.offset),
+                float(error) if error is not None else -1.0
+            ])
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def handle_play(self, video_name, offset=0.0, start_seconds=None, start_microseconds=0):
+        """
+        Handle incoming play command, with an optional start offset in seconds for resyncs.
+
+        Commands from the master's timetagged bundles carry their start time (the master's
+        time.time() as whole seconds and microseconds); those clips are opened right away
+        and start at that instant of the synchronized clock instead of when the command
+        is read.
+        """
         video_name = video_name.decode()
         print(f"Received play command for: {video_name}")
-        self.player.video_queue.put(video_name)
+        if video_name not in self.player.available_videos:
+            print(f"Video not found: {video_name}")
+            return
+        self._send_to_master(b'/ack', [self.name.encode(), video_name.encode()])
+        if start_seconds is None:
+            self.player.video_queue.put((video_name, float(offset)))
+            return
+        start_at = time.monotonic() + join_time(start_seconds, start_microseconds) - self.clock.time()
+        # Taken here rather than in the main loop: the /segment that follows in the
+        # same bundle no longer lists this clip and would close it
+        prefetched = self.player.take_prefetched(video_name)
+        self.player.schedule_queue.put((video_name, float(offset), start_at, prefetched))
+
+    def handle_segment(self, *values):
+        """
+        Handle the upcoming clips the master announces with each play, as (name,
+        start seconds, start microseconds) triples, by updating the prefetch window
+        """
+        # Converts master clock times to time.monotonic()
+        to_monotonic = time.monotonic() - self.clock.time()
+        segment = [
+            (values[i].decode(), to_monotonic + join_time(values[i + 1], values[i + 2]))
+            for i in range(0, len(values) - 2, 3)
+        ]
+        self.player.segment_queue.put(segment)
 
     def handle_stop(self):
         """Handle stop command"""
@@ -220,10 +462,12 @@ def main():
                       help='Display orientation (hor/ver)')
     parser.add_argument('--node', required=True, type=int, choices=[1, 2],
                       help='Node number (1 or 2)')
+    parser.add_argument('--master', default='192.168.1.201',
+                      help='Address of the master node, the reference clock')
     args = parser.parse_args()
     
     try:
-        slave = SlaveNode(args.orientation, args.node)
+        slave = SlaveNode(args.orientation, args.node, args.master)
         slave.run()
     except Exception as e:
         print(f"Error: {e}")
@@ -74,7 +74,10 @@ deploy_to_host() {
     echo "Copying Python files..."
     sshpass -p "${PASSWORD}" scp -r -o StrictHostKeyChecking=no \
         "${SOURCE_DIR}/offline_slave.py" \
+        "${SOURCE_DIR}/ontology_store.py" \
         "${SOURCE_DIR}/ontology_map.json" \
+        "${SOURCE_DIR}/ontology_map.bin" \
+        "${SOURCE_DIR}/ontology_map_stats.json" \
         "pi@${host}:${VIDEO_PLAYER_DIR}/"
     
     # Clear and recreate logs directory
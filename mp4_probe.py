@@ -0,0 +1,456 @@
+import os
+import struct
+import time
+import argparse
+from fractions import Fraction
+from pathlib import Path
+
+# Boxes whose payload is just a list of child boxes
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts'}
+
+
+class MP4ParseError(Exception):
+    """Raised when a file is not a readable ISO base media (MP4) file."""
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise MP4ParseError("Unexpected end of file")
+    return data
+
+
+def _iter_boxes(f, start, end):
+    """
+    Iterate over the boxes between two file offsets, seeking over their payloads.
+
+    Yields:
+        tuple: (box type, payload start offset, box end offset)
+    """
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, box_type = struct.unpack('>I4s', _read_exact(f, 8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', _read_exact(f, 8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise MP4ParseError(f"Invalid size for box {box_type!r} at offset {offset}")
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def _find_box(f, start, end, box_type):
+    for child_type, payload_start, box_end in _iter_boxes(f, start, end):
+        if child_type == box_type:
+            return payload_start, box_end
+    return None
+
+
+def _read_full_box(f, payload_start, box_end):
+    """Read a full box (version + flags header) and return (version, body)."""
+    f.seek(payload_start)
+    data = _read_exact(f, box_end - payload_start)
+    return data[0], data[4:]
+
+
+def _parse_tkhd(version, body):
+    """Track header: presentation width/height (16.16 fixed point) and rotation."""
+    # creation/modification time, track id, reserved, duration
+    offset = 32 if version == 1 else 20
+    # reserved(8) layer(2) alternate group(2) volume(2) reserved(2)
+    offset += 16
+    matrix = struct.unpack_from('>9i', body, offset)
+    offset += 36
+    width, height = struct.unpack_from('>II', body, offset)
+    width, height = width >> 16, height >> 16
+    # A 90/270 degree rotation matrix has a zero diagonal; report the displayed size
+    if matrix[0] == 0 and matrix[4] == 0:
+        width, height = height, width
+    return width, height
+
+
+def _parse_mdhd(version, body):
+    """Media header: timescale and duration in timescale units."""
+    if version == 1:
+        timescale, duration = struct.unpack_from('>IQ', body, 16)
+    else:
+        timescale, duration = struct.unpack_from('>II', body, 8)
+    return timescale, duration
+
+
+def _parse_stts(body):
+    """Decoding time-to-sample table as a list of (sample count, sample delta)."""
+    entry_count = struct.unpack_from('>I', body, 0)[0]
+    return [struct.unpack_from('>II', body, 4 + 8 * i) for i in range(entry_count)]
+
+
+def _parse_stsz(body):
+    """Sample size table header: number of samples in the track."""
+    sample_size, sample_count = struct.unpack_from('>II', body, 0)
+    return sample_count
+
+
+def _parse_sample_sizes(body):
+    """Size in bytes of every sample."""
+    sample_size, sample_count = struct.unpack_from('>II', body, 0)
+    if sample_size:
+        return [sample_size] * sample_count
+    return list(struct.unpack_from(f'>{sample_count}I', body, 8))
+
+
+def _parse_stss(body):
+    """Sync sample table: 1-based numbers of the keyframe samples."""
+    entry_count = struct.unpack_from('>I', body, 0)[0]
+    return list(struct.unpack_from(f'>{entry_count}I', body, 4))
+
+
+def _parse_stsc(body):
+    """Sample-to-chunk table as a list of (first chunk, samples per chunk)."""
+    entry_count = struct.unpack_from('>I', body, 0)[0]
+    return [struct.unpack_from('>II', body, 4 + 12 * i) for i in range(entry_count)]
+
+
+def _parse_chunk_offsets(box_type, body):
+    """File offsets of every chunk, from stco (32-bit) or co64 (64-bit)."""
+    entry_count = struct.unpack_from('>I', body, 0)[0]
+    offset_format = 'Q' if box_type == b'co64' else 'I'
+    return list(struct.unpack_from(f'>{entry_count}{offset_format}', body, 4))
+
+
+def _parse_ctts(version, body):
+    """Composition offset table as a list of (sample count, offset)."""
+    entry_count = struct.unpack_from('>I', body, 0)[0]
+    entry_format = '>Ii' if version == 1 else '>II'
+    return [struct.unpack_from(entry_format, body, 4 + 8 * i) for i in range(entry_count)]
+
+
+def _parse_elst(version, body):
+    """Edit list: media time (in media timescale units) where presentation starts."""
+    entry_count = struct.unpack_from('>I', body, 0)[0]
+    entry_format, entry_size = ('>Qq', 20) if version == 1 else ('>Ii', 12)
+    for i in range(entry_count):
+        _, media_time = struct.unpack_from(entry_format, body, 4 + entry_size * i)
+        # media_time -1 marks an empty edit (a delay before the media starts)
+        if media_time != -1:
+            return media_time
+    return 0
+
+
+def _sample_times(track):
+    """
+    Decode and presentation time of every sample, in media timescale units.
+
+    Yields:
+        tuple: (decode time, presentation time) per sample, in decode order
+    """
+    ctts = iter(track['ctts'])
+    ctts_left, ctts_offset = 0, 0
+    dts = 0
+    for count, delta in track['stts']:
+        for _ in range(count):
+            if track['ctts']:
+                if ctts_left == 0:
+                    ctts_left, ctts_offset = next(ctts, (1 << 32, 0))
+                ctts_left -= 1
+            yield dts, dts + ctts_offset - track['media_time']
+            dts += delta
+
+
+def _parse_video_track(f, trak_start, trak_end):
+    """
+    Read the headers of a track.
+
+    Returns:
+        dict: Raw track information if this is a video track, otherwise None
+    """
+    mdia = _find_box(f, trak_start, trak_end, b'mdia')
+    if mdia is None:
+        return None
+
+    hdlr = _find_box(f, *mdia, b'hdlr')
+    if hdlr is None:
+        return None
+    _, body = _read_full_box(f, *hdlr)
+    if body[4:8] != b'vide':
+        return None
+
+    tkhd = _find_box(f, trak_start, trak_end, b'tkhd')
+    mdhd = _find_box(f, *mdia, b'mdhd')
+    minf = _find_box(f, *mdia, b'minf')
+    stbl = _find_box(f, *minf, b'stbl') if minf else None
+    if tkhd is None or mdhd is None or stbl is None:
+        raise MP4ParseError("Video track is missing required headers")
+
+    width, height = _parse_tkhd(*_read_full_box(f, *tkhd))
+    timescale, media_duration = _parse_mdhd(*_read_full_box(f, *mdhd))
+
+    media_time = 0
+    edts = _find_box(f, trak_start, trak_end, b'edts')
+    elst = _find_box(f, *edts, b'elst') if edts else None
+    if elst:
+        media_time = _parse_elst(*_read_full_box(f, *elst))
+
+    tables = {}
+    for box_type, payload_start, box_end in _iter_boxes(f, *stbl):
+        if box_type in (b'stts', b'stsz', b'ctts', b'stss', b'stsc', b'stco', b'co64'):
+            tables[box_type] = _read_full_box(f, payload_start, box_end)
+    if b'stts' not in tables:
+        raise MP4ParseError("Video track has no stts box")
+
+    stts = _parse_stts(tables[b'stts'][1])
+    frame_count = sum(count for count, _ in stts)
+    if b'stsz' in tables:
+        frame_count = _parse_stsz(tables[b'stsz'][1])
+    ctts = _parse_ctts(*tables[b'ctts']) if b'ctts' in tables else []
+
+    return {
+        'width': width,
+        'height': height,
+        'timescale': timescale,
+        'media_duration': media_duration,
+        'frame_count': frame_count,
+        'media_time': media_time,
+        'stts': stts,
+        'ctts': ctts,
+        # Raw sample tables, only decoded when a keyframe index is requested
+        'tables': {box_type: body for box_type, (_, body) in tables.items()}
+    }
+
+
+def probe_mp4(video_path):
+    """
+    Read the video track headers of an MP4 file without decoding anything.
+
+    Only the box headers are read; `mdat` and any other large payloads are skipped
+    with seeks, so the cost is independent of the file size.
+
+    Args:
+        video_path (str or Path): Path to the MP4 file
+
+    Returns:
+        dict: Raw information about the first video track: width, height, timescale,
+              media_duration, frame_count, the edit list media_time, the stts and
+              ctts tables, and the raw sample tables
+
+    Raises:
+        MP4ParseError: If the file has no readable video track
+    """
+    with open(video_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        moov = _find_box(f, 0, file_size, b'moov')
+        if moov is None:
+            raise MP4ParseError("No moov box found")
+
+        for box_type, payload_start, box_end in _iter_boxes(f, *moov):
+            if box_type == b'trak':
+                track = _parse_video_track(f, payload_start, box_end)
+                if track is not None:
+                    return track
+    raise MP4ParseError("No video track found")
+
+
+def normalize_fps(fps):
+    """Keep integral frame rates as ints and round fractional ones (e.g. 29.97)."""
+    fps = float(fps)
+    return int(fps) if fps.is_integer() else round(fps, 3)
+
+
+def to_microseconds(seconds):
+    """Round an exact (Fraction) time in seconds to integer microseconds."""
+    return round(Fraction(seconds) * 1000000)
+
+
+def exact_timing(frame_rate, timebase, frame_count, duration, first_pts, last_pts):
+    """
+    Frame-exact timing fields of an ontology entry.
+
+    Args:
+        frame_rate (Fraction): Frames per second, e.g. 30000/1001
+        timebase (Fraction): Seconds per tick of the stream clock
+        frame_count (int): Number of frames
+        duration (Fraction): Exact duration in seconds
+        first_pts (Fraction): Presentation time of the first frame, in seconds
+        last_pts (Fraction): Presentation time of the last frame, in seconds
+
+    Returns:
+        dict: frame_rate and timebase as "num/den" strings, frame_count, and
+              duration_us, first_pts_us and last_pts_us in integer microseconds
+    """
+    return {
+        "frame_rate": f"{frame_rate.numerator}/{frame_rate.denominator}",
+        "timebase": f"{timebase.numerator}/{timebase.denominator}",
+        "frame_count": frame_count,
+        "duration_us": to_microseconds(duration),
+        "first_pts_us": to_microseconds(first_pts),
+        "last_pts_us": to_microseconds(last_pts)
+    }
+
+
+def get_mp4_metadata(video_path):
+    """
+    Extract technical metadata from an MP4 file by reading its headers.
+
+    Args:
+        video_path (Path): Path to the video file to analyze.
+
+    Returns:
+        dict: Same fields as VideoOntologyMapper.get_video_metadata:
+              width, height, fps, duration in seconds and the exact timing fields
+              (see exact_timing)
+    """
+    track = probe_mp4(video_path)
+    total_delta = sum(count * delta for count, delta in track['stts'])
+    if not track['timescale'] or not total_delta:
+        raise MP4ParseError("Video track has no duration")
+
+    # Exact rational frame rate, e.g. 30000/1001 for 29.97 fps material
+    fps = Fraction(track['frame_count'] * track['timescale'], total_delta)
+    duration = Fraction(total_delta, track['timescale'])
+
+    presentation_times = [pts for _, pts in _sample_times(track)]
+    timebase = Fraction(1, track['timescale'])
+
+    return {
+        "width": track['width'],
+        "height": track['height'],
+        "fps": normalize_fps(fps),
+        "duration": round(float(duration), 2),
+        **exact_timing(fps, timebase, track['frame_count'], duration,
+                       min(presentation_times) * timebase, max(presentation_times) * timebase)
+    }
+
+
+def get_keyframe_index(video_path):
+    """
+    Presentation time and byte offset of every keyframe of an MP4 file.
+
+    Built from the sync sample (stss), sample size (stsz), sample-to-chunk (stsc)
+    and chunk offset (stco/co64) tables, so no frame is decoded.
+
+    Args:
+        video_path (Path): Path to the video file
+
+    Returns:
+        list: [pts_us, byte_offset] per keyframe, sorted by presentation time
+    """
+    track = probe_mp4(video_path)
+    tables = track['tables']
+    if b'stsz' not in tables or b'stsc' not in tables:
+        raise MP4ParseError("Video track has no sample tables")
+    chunk_box = b'co64' if b'co64' in tables else b'stco'
+    if chunk_box not in tables:
+        raise MP4ParseError("Video track has no chunk offsets")
+
+    sizes = _parse_sample_sizes(tables[b'stsz'])
+    chunk_offsets = _parse_chunk_offsets(chunk_box, tables[chunk_box])
+    stsc = _parse_stsc(tables[b'stsc'])
+
+    # Byte offset of every sample, walking the chunks in order
+    sample_offsets = []
+    for entry_index, (first_chunk, samples_per_chunk) in enumerate(stsc):
+        last_chunk = stsc[entry_index + 1][0] - 1 if entry_index + 1 < len(stsc) else len(chunk_offsets)
+        for chunk in range(first_chunk, last_chunk + 1):
+            offset = chunk_offsets[chunk - 1]
+            for _ in range(samples_per_chunk):
+                if len(sample_offsets) == len(sizes):
+                    break
+                sample_offsets.append(offset)
+                offset += sizes[len(sample_offsets) - 1]
+
+    # Without an stss box every sample is a keyframe
+    sync_samples = _parse_stss(tables[b'stss']) if b'stss' in tables else range(1, len(sizes) + 1)
+    presentation_times = [pts for _, pts in _sample_times(track)]
+    timebase = Fraction(1, track['timescale'])
+
+    keyframes = []
+    for sample_number in sync_samples:
+        index = sample_number - 1
+        if index < len(sample_offsets) and index < len(presentation_times):
+            keyframes.append([to_microseconds(presentation_times[index] * timebase),
+                              sample_offsets[index]])
+    keyframes.sort()
+    return keyframes
+
+
+def benchmark(root_dir, limit=None):
+    """
+    Compare the header parser against the OpenCV probe on an archive.
+    Prints the time per file for each backend and any metadata differences.
+    """
+    import cv2
+
+    video_files = sorted(Path(root_dir).rglob('*.mp4'))[:limit]
+    if not video_files:
+        print(f"No MP4 files found in {root_dir}")
+        return
+
+    def cv2_metadata(video_path):
+        cap = cv2.VideoCapture(str(video_path))
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            return {
+                "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                "fps": normalize_fps(fps),
+                "duration": round(frame_count / fps, 2) if fps > 0 else 0
+            }
+        finally:
+            cap.release()
+
+    results = {}
+    for name, probe in (('cv2', cv2_metadata), ('mp4', get_mp4_metadata)):
+        start = time.perf_counter()
+        results[name] = []
+        for video_path in video_files:
+            try:
+                results[name].append(probe(video_path))
+            except Exception as e:
+                results[name].append(f"error: {str(e)}")
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {elapsed:.2f}s total, {1000 * elapsed / len(video_files):.2f}ms per file")
+
+    mismatches = 0
+    for video_path, cv2_result, mp4_result in zip(video_files, results['cv2'], results['mp4']):
+        # The header parser also reports exact timing fields OpenCV cannot provide;
+        # only the fields both backends produce are compared
+        if isinstance(cv2_result, dict) and isinstance(mp4_result, dict):
+            shared = cv2_result.keys() & mp4_result.keys()
+            differs = any(cv2_result[key] != mp4_result[key] for key in shared)
+        else:
+            differs = cv2_result != mp4_result
+        if differs:
+            mismatches += 1
+            print(f"Mismatch for {video_path}:\n  cv2: {cv2_result}\n  mp4: {mp4_result}")
+    print(f"{len(video_files)} files, {mismatches} mismatches")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MP4 header probe')
+    parser.add_argument('paths', nargs='*', help='MP4 files to probe')
+    parser.add_argument('--benchmark', metavar='ROOT',
+                      help='Benchmark against OpenCV on every MP4 under ROOT')
+    parser.add_argument('--limit', type=int, default=None,
+                      help='Maximum number of files to benchmark')
+    parser.add_argument('--keyframes', action='store_true',
+                      help='Also print the keyframe index of each file')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.limit)
+    for path in args.paths:
+        try:
+            print(f"{path}: {get_mp4_metadata(path)}")
+            if args.keyframes:
+                for pts_us, byte_offset in get_keyframe_index(path):
+                    print(f"  keyframe {pts_us / 1000000:.6f}s @ byte {byte_offset}")
+        except (OSError, MP4ParseError) as e:
+            print(f"{path}: error: {str(e)}")
+
+
+if __name__ == "__main__":
+    main()
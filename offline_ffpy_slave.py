@@ -1,5 +1,5 @@
-import json
 import os
+from ontology_store import load_ontology, get_bucket_index, clip_duration, load_stats
 import pygame
 from ffpyplayer.player import MediaPlayer
 import random
@@ -8,15 +8,14 @@ import time
 from threading import Thread, Event
 from queue import Queue, Empty
 
-def get_absolute_video_path(relative_path):
-    base_dir = '/home/pi/video_player'
-    return os.path.join(base_dir, relative_path)
+BASE_DIR = '/home/pi/video_player'
 
-# Load metadata
-with open('/home/pi/video_player/ontology_map.json', 'r') as f:
-    videos = json.load(f)
-    for video in videos:
-        video['path'] = get_absolute_video_path(video['path'])
+# Load metadata (memory-mapped binary ontology when available, JSON otherwise)
+ONTOLOGY_FILE = os.path.join(BASE_DIR, 'ontology_map.json')
+videos = load_ontology(ONTOLOGY_FILE, base_dir=BASE_DIR)
+
+# Seconds behind schedule after which the timeline restarts instead of catching up
+MAX_SCHEDULE_LAG = 5.0
 
 class OfflinePlayer:
     def __init__(self, device_name):
@@ -24,6 +23,7 @@ class OfflinePlayer:
         self.orientation = device_name[:3]  # 'hor' or 'ver'
         self.node_number = int(device_name[3])  # 1 or 2
         self.current_seed = 1
+        self.next_deadline = None  # Scheduled end of the current clip
         
         # Initialize pygame display
         pygame.init()
@@ -51,9 +51,16 @@ class OfflinePlayer:
         self.current_queue = Queue(maxsize=16)  # Increased buffer size
         self.stop_event = Event()
         
-        # Get unique categories
-        self.categories = sorted(set(video['category'] for video in videos))
+        # Bucket index: (category, orientation, type) -> videos, looked up in O(1)
+        self.buckets = get_bucket_index(videos)
+        
+        # Per-node clip counts and loop lengths from the cartography stats sidecar;
+        # categories with nothing to play on this node are skipped
+        self.stats = load_stats(ONTOLOGY_FILE, self.buckets)['nodes'][device_name]
+        self.categories = [category for category in self.buckets.categories()
+                           if self.stats['categories'].get(category, {}).get('clips')]
         print(f"\nFound {len(self.categories)} categories: {self.categories}")
+        print(f"Loop: {self.stats['clips']} clips, {self.stats['loop_length']:.1f}s expected")
 
     def _fetch_frames(self, player, queue):
         """Fetch frames from player to queue"""
@@ -102,6 +109,21 @@ class OfflinePlayer:
                     frame_count = 0
                     last_print = time.time()
 
+    def _advance_deadline(self, video):
+        """
+        Schedule the end of a clip and return its deadline (time.monotonic()).
+        
+        Deadlines are chained from the previous clip's deadline using the exact
+        clip duration, not from the time the clip actually started, so start-up
+        latency and rounding never accumulate into drift over long runs.
+        """
+        now = time.monotonic()
+        if self.next_deadline is None or now - self.next_deadline > MAX_SCHEDULE_LAG:
+            # First clip, or too far behind to catch up: restart the timeline
+            self.next_deadline = now
+        self.next_deadline += clip_duration(video)
+        return self.next_deadline
+
     def _play_video(self, video):
         """Play a single video"""
         print(f"\nPlaying: {video['name']}")
@@ -119,6 +141,7 @@ class OfflinePlayer:
             })
             
             self.current_queue = Queue(maxsize=16)
+            deadline = self._advance_deadline(video)
             
             # Start frame fetching thread
             fetch_thread = Thread(target=self._fetch_frames, 
@@ -126,12 +149,14 @@ class OfflinePlayer:
             fetch_thread.daemon = True
             fetch_thread.start()
             
-            # Display frames with minimal processing
+            # Display frames with minimal processing until the clip's scheduled end
             clock = pygame.time.Clock()
-            while not self.stop_event.is_set():
+            while not self.stop_event.is_set() and time.monotonic() < deadline:
                 try:
                     frame = self.current_queue.get_nowait()
                     if frame == "EOF":
+                        # Hold the last frame until the scheduled end
+                        time.sleep(max(0, deadline - time.monotonic()))
                         break
                     if isinstance(frame, pygame.Surface):
                         self.screen.blit(frame, (0, 0))
@@ -146,16 +171,11 @@ class OfflinePlayer:
         """Prepare a playlist for a category"""
         random.seed(self.current_seed)
         
-        # Filter videos for this category and orientation
-        category_videos = [v for v in videos 
-                         if v['category'] == category 
-                         and v['orientation'] == self.orientation]  # Direct match with 'hor' or 'ver'
-        
-        print(f"Found {len(category_videos)} videos for {self.orientation} orientation in {category}")
+        # Look up animated and text videos for this category and orientation
+        animated = self.buckets.select(videos, category, self.orientation, 'animated')
+        text = self.buckets.select(videos, category, self.orientation, 'text')
         
-        # Separate animated and text videos
-        animated = [v for v in category_videos if v['video_type'] == 'animated']
-        text = [v for v in category_videos if v['video_type'] == 'text']
+        print(f"Found {len(animated) + len(text)} videos for {self.orientation} orientation in {category}")
         
         print(f"  Animated videos: {len(animated)}")
         print(f"  Text videos: {len(text)}")
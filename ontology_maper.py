@@ -1,8 +1,224 @@
 import os
 import json
 import cv2
+import time
+import argparse
+import multiprocessing
+from multiprocessing.connection import wait
 from pathlib import Path
 import re
+import hashlib
+import subprocess
+from mp4_probe import get_mp4_metadata, get_keyframe_index, normalize_fps, MP4ParseError
+from ontology_store import write_binary_ontology, binary_path, keyframe_index_path, ontology_hash
+
+# Revision of the metadata the backends produce, part of the probe cache variant so
+# results cached by an older revision are probed again
+PROBE_REVISION = 2
+
+
+def _probe_worker(mapper, conn):
+    """
+    Worker loop for parallel scans. Receives file paths over `conn`, probes
+    each one with the mapper and sends back its technical metadata (or None).
+    A None path tells the worker to exit.
+    """
+    while True:
+        try:
+            file_path = conn.recv()
+        except EOFError:
+            break
+        if file_path is None:
+            break
+        try:
+            result = mapper.get_video_metadata(file_path)
+        except Exception as e:
+            print(f"Error processing {file_path}: {str(e)}")
+            result = None
+        conn.send(result)
+    conn.close()
+
+
+def content_fingerprint(file_path, size=None, chunk_size=64 * 1024):
+    """
+    Cheap sampled fingerprint of a file's contents.
+
+    Hashes the file size together with a chunk from the head, the middle and the
+    tail of the file. Re-exports with identical bytes and renamed or moved copies
+    get the same fingerprint, while only 3 chunks are ever read.
+
+    Args:
+        file_path (Path): File to fingerprint
+        size (int): File size, if the caller already has it
+        chunk_size (int): Bytes read at each sample position
+
+    Returns:
+        str: Hex digest identifying the file contents
+    """
+    if size is None:
+        size = os.path.getsize(file_path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(file_path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - chunk_size // 2), max(0, size - chunk_size)}):
+            f.seek(offset)
+            digest.update(f.read(chunk_size))
+    return digest.hexdigest()
+
+
+class ProbeCache:
+    """
+    Persistent on-disk cache of video probe results.
+
+    Entries are keyed by file path and validated against the file's size,
+    modification time and inode, so an unchanged file is never probed twice
+    while a replaced or re-exported file is always probed again. Entries also
+    record the content fingerprint of the file, so a moved or renamed file can
+    be matched to the metadata of its previous path.
+    """
+
+    def __init__(self, cache_file='ontology_probe_cache.json', variant=None):
+        """
+        Load the cache from disk if it exists.
+
+        Args:
+            cache_file (str): Path of the JSON file backing the cache.
+            variant (str): Tag of the probe that produced the metadata (e.g. the metadata
+                           backend). Entries stored under another variant are treated as misses.
+        """
+        self.cache_file = Path(cache_file)
+        self.variant = variant
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if self.cache_file.exists():
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Ignoring unreadable probe cache {self.cache_file}: {str(e)}")
+        # Content fingerprint -> paths of the entries with those contents (as dict keys,
+        # in insertion order), so finding moved or copied files needs no scan
+        self.by_fingerprint = {}
+        for path, entry in self.entries.items():
+            self._index(path, entry)
+
+    def _index(self, path, entry):
+        if entry.get('fingerprint'):
+            self.by_fingerprint.setdefault(entry['fingerprint'], {})[path] = None
+
+    def _unindex(self, path):
+        entry = self.entries.get(path)
+        paths = self.by_fingerprint.get(entry.get('fingerprint')) if entry else None
+        if paths is not None:
+            paths.pop(path, None)
+            if not paths:
+                del self.by_fingerprint[entry['fingerprint']]
+
+    @staticmethod
+    def file_signature(stat):
+        """Identity of a file's contents as far as a stat() call can tell."""
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def get(self, file_path, stat):
+        """
+        Look up cached metadata for a file.
+
+        Args:
+            file_path (Path): Path of the video file
+            stat (os.stat_result): Current stat of the file
+
+        Returns:
+            dict: Cached metadata if the file is unchanged since it was probed.
+            None: If the file is not cached or has changed.
+        """
+        entry = self.entries.get(str(file_path))
+        if (entry and entry['signature'] == self.file_signature(stat)
+                and entry.get('variant') == self.variant):
+            self.hits += 1
+            return entry['metadata']
+        self.misses += 1
+        return None
+
+    def get_fingerprint(self, file_path, stat):
+        """Cached content fingerprint of a file, or None if unknown or stale."""
+        entry = self.entries.get(str(file_path))
+        if entry and entry['signature'] == self.file_signature(stat):
+            return entry.get('fingerprint')
+        return None
+
+    def find_fingerprint(self, fingerprint, file_path=None):
+        """
+        Find a cached probe result for another file with the same contents.
+
+        Args:
+            fingerprint (str): Content fingerprint to look for
+            file_path (Path): The file being looked up, whose own (stale) entry is skipped
+
+        Returns:
+            tuple: (path, metadata) of a matching entry, or None
+        """
+        for path in self.by_fingerprint.get(fingerprint, ()):
+            entry = self.entries[path]
+            if path != str(file_path) and entry.get('variant') == self.variant:
+                return path, entry['metadata']
+        return None
+
+    def put(self, file_path, stat, metadata, fingerprint=None):
+        """Store the probe result for a file."""
+        path = str(file_path)
+        self._unindex(path)
+        self.entries[path] = {
+            'signature': self.file_signature(stat),
+            'variant': self.variant,
+            'fingerprint': fingerprint,
+            'metadata': metadata
+        }
+        self._index(path, self.entries[path])
+
+    def get_keyframes(self, file_path, stat):
+        """Cached keyframe index of a file, or None if unknown or stale."""
+        entry = self.entries.get(str(file_path))
+        if entry and entry['signature'] == self.file_signature(stat):
+            return entry.get('keyframes')
+        return None
+
+    def put_keyframes(self, file_path, stat, keyframes):
+        """
+        Store the keyframe index of a file next to its probe result.
+
+        Returns:
+            bool: False if the file has no up-to-date entry to attach it to
+        """
+        entry = self.entries.get(str(file_path))
+        if not entry or entry['signature'] != self.file_signature(stat):
+            return False
+        entry['keyframes'] = keyframes
+        return True
+
+    def prune(self, live_paths):
+        """
+        Evict entries for files that are no longer part of the archive.
+
+        Args:
+            live_paths (iterable): Paths of the files found by the current scan
+
+        Returns:
+            int: Number of evicted entries
+        """
+        live = {str(path) for path in live_paths}
+        stale = [path for path in self.entries if path not in live]
+        for path in stale:
+            self._unindex(path)
+            del self.entries[path]
+        return len(stale)
+
+    def save(self):
+        """Write the cache to disk atomically."""
+        tmp_file = self.cache_file.with_name(self.cache_file.name + '.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
+
 
 class VideoOntologyMapper:
     """
@@ -16,22 +232,62 @@ class VideoOntologyMapper:
     through their organization, metadata, and relationships.
     """
 
-    def __init__(self, root_dir="Videos_hd_final"):
+    BACKENDS = ('cv2', 'mp4')
+
+    def __init__(self, root_dir="Videos_hd_final", workers=1, probe_timeout=30.0, cache_file=None,
+                 backend='cv2', skip_duplicates=False):
         """
         Initialize the hyperobject video mapper with a root archive directory.
 
         Args:
             root_dir (str): Root directory containing the hyperobject video collection. Defaults to "Generados".
+            workers (int): Number of worker processes used to probe videos. 1 scans serially.
+            probe_timeout (float): Seconds a worker may spend on a single file before it is
+                                   killed and the file is skipped. Only applies to parallel scans.
+            cache_file (str): Persistent probe cache. Unchanged files reuse their cached
+                              metadata instead of being probed again. None disables caching.
+            backend (str): Metadata backend. 'cv2' opens each file with OpenCV, 'mp4' reads
+                           the MP4 headers directly without initialising a decoder.
+            skip_duplicates (bool): Leave files whose contents duplicate an earlier file out of
+                                    the ontology instead of only flagging them.
         """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown metadata backend: {backend}")
         self.root_dir = Path(root_dir)
         self.database = []
         self.orientation_patterns = re.compile(r'^(hor|ver)', re.IGNORECASE)
+        self.workers = max(1, int(workers))
+        self.probe_timeout = probe_timeout
+        self.backend = backend
+        self.cache = ProbeCache(cache_file, variant=f"{backend}/{PROBE_REVISION}") if cache_file else None
+        self.skip_duplicates = skip_duplicates
+        # Content fingerprint -> ontology paths of the files with those contents
+        self.fingerprint_index = {}
 
     def get_video_metadata(self, video_path):
         """
         Extract technical metadata from a video file.
         This metadata helps establish video documentation patterns and archival qualities.
 
+        Args:
+            video_path (Path): Path to the video file to analyze.
+
+        Returns:
+            dict: Technical metadata including dimensions, framerate and duration.
+            None: If video metadata cannot be extracted.
+        """
+        if self.backend == 'mp4':
+            try:
+                return get_mp4_metadata(video_path)
+            except (OSError, MP4ParseError) as e:
+                print(f"Error processing {video_path}: {str(e)}")
+                return None
+        return self.get_opencv_metadata(video_path)
+
+    def get_opencv_metadata(self, video_path):
+        """
+        Extract technical metadata by opening the video with OpenCV.
+
         Args:
             video_path (Path): Path to the video file to analyze.
 
@@ -47,22 +303,87 @@ class VideoOntologyMapper:
             # Get basic properties
             width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
             height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = int(cap.get(cv2.CAP_PROP_FPS))
+            fps = cap.get(cv2.CAP_PROP_FPS)
             frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
             duration = frame_count / fps if fps > 0 else 0
 
             cap.release()
 
-            return {
+            metadata = {
                 "width": width,
                 "height": height,
-                "fps": fps,
+                "fps": normalize_fps(fps),
                 "duration": round(duration, 2)
             }
+            # OpenCV only exposes a float frame rate and frame count, which cannot give the
+            # stream timebase or timestamps: take the exact timing fields from the MP4 sample
+            # tables, and leave them out for other containers rather than guess them
+            try:
+                exact = get_mp4_metadata(video_path)
+                metadata.update({key: value for key, value in exact.items() if key not in metadata})
+            except (OSError, MP4ParseError):
+                pass
+            return metadata
         except Exception as e:
             print(f"Error processing {video_path}: {str(e)}")
             return None
 
+    def get_cached_metadata(self, file_path, stat=None):
+        """
+        Get technical metadata for a video, probing it only if the cache has no
+        up-to-date entry for it.
+
+        Args:
+            file_path (Path): Path to the video file to analyze.
+            stat (os.stat_result): Stat of the file, if the caller already has it.
+
+        Returns:
+            dict: Technical metadata, or None if it cannot be extracted.
+        """
+        if self.cache is None:
+            return self.get_video_metadata(file_path)
+
+        stat = stat or file_path.stat()
+        metadata = self.cache.get(file_path, stat)
+        if metadata is None:
+            fingerprint = content_fingerprint(file_path, stat.st_size)
+            metadata = self.find_known_contents(file_path, fingerprint)
+            if metadata is None:
+                metadata = self.get_video_metadata(file_path)
+            if metadata:
+                self.cache.put(file_path, stat, metadata, fingerprint)
+        return metadata
+
+    def get_fingerprint(self, file_path, stat=None):
+        """Content fingerprint of a video, reusing the cached one if the file is unchanged."""
+        stat = stat or file_path.stat()
+        fingerprint = self.cache.get_fingerprint(file_path, stat) if self.cache is not None else None
+        return fingerprint or content_fingerprint(file_path, stat.st_size)
+
+    def find_known_contents(self, file_path, fingerprint):
+        """
+        Reuse the probe result of a cached file with the same contents, e.g. when a
+        clip was moved, renamed or re-exported byte for byte.
+
+        Args:
+            file_path (Path): Path of the uncached video file
+            fingerprint (str): Its content fingerprint
+
+        Returns:
+            dict: Metadata of the matching file, or None if its contents are new
+        """
+        if self.cache is None:
+            return None
+        match = self.cache.find_fingerprint(fingerprint, file_path)
+        if match is None:
+            return None
+        known_path, metadata = match
+        if os.path.exists(known_path):
+            print(f"Same contents as {known_path}: {file_path}")
+        else:
+            print(f"Moved {known_path} -> {file_path}")
+        return metadata
+
     def get_path_info(self, file_path):
         """
         Infer hyperobject categorical and spatial orientation information from file location.
@@ -101,13 +422,14 @@ class VideoOntologyMapper:
         
         return category, orientation
 
-    def process_video_file(self, file_path):
+    def process_video_file(self, file_path, metadata=None, fingerprint=None):
         """
         Build a complete hyperobject ontological entry for a video by analyzing its metadata and location.
         
         The function performs the following steps:
         1. Validates the file is an MP4 video
-        2. Extracts technical metadata like dimensions, framerate and duration using OpenCV
+        2. Extracts technical metadata like dimensions, framerate and duration using the selected backend,
+           reusing the probe cache for files that have not changed
         3. Analyzes the file path to determine category and orientation based on folder structure
         4. Determines video type (animated or text) based on filename patterns
         5. Combines all information into a standardized ontology entry
@@ -122,9 +444,17 @@ class VideoOntologyMapper:
         - height: Video height in pixels 
         - fps: Frames per second
         - duration: Length in seconds
+        - frame_rate, timebase: Exact rational frame rate and stream timebase ("num/den")
+        - frame_count: Number of frames
+        - duration_us, first_pts_us, last_pts_us: Exact duration and first/last presentation
+          timestamps in microseconds, used for drift-free scheduling
+          (exact fields are only present for MP4 files with the cv2 backend)
+        - fingerprint: Sampled content fingerprint, shared by identical copies
 
         Args:
             file_path (Path): Path to the video file to analyze and index
+            metadata (dict): Already extracted technical metadata, e.g. from a parallel probe
+            fingerprint (str): Already computed content fingerprint of the file
 
         Returns:
             dict: Complete hyperobject ontological information for the video with all metadata
@@ -134,9 +464,12 @@ class VideoOntologyMapper:
         if not str(file_path).lower().endswith('.mp4'):
             return None
 
-        metadata = self.get_video_metadata(file_path)
+        if metadata is None:
+            metadata = self.get_cached_metadata(file_path)
         if not metadata:
             return None
+        if fingerprint is None:
+            fingerprint = self.get_fingerprint(file_path)
 
         category, orientation = self.get_path_info(file_path)
         
@@ -146,48 +479,570 @@ class VideoOntologyMapper:
         
         return {
             "name": file_path.name,
-            "path": str(self.root_dir) + '/' + str(file_path.relative_to(self.root_dir)),
+            "path": self.get_entry_path(file_path),
             "category": category,
             "orientation": orientation,
             "video_type": video_type,
-            **metadata
+            **metadata,
+            "fingerprint": fingerprint
         }
 
-    def scan_directory(self):
+    def find_video_files(self):
         """
-        Recursively scan the archive to build the complete hyperobject video ontology.
-        Maps all valid video documentation and their relationships into the database.
+        List the archive videos that belong in the ontology, in scan order.
+
+        Returns:
+            list: Paths of the MP4 files to index
         """
+        video_files = []
         for file_path in self.root_dir.rglob('*.mp4'):
             # Skip if file doesn't contain 'hor' AND doesn't contain 'rotated'
             if ('hor' not in str(file_path).lower()) and ('rotated' not in str(file_path).lower()):
                 continue
-            video_data = self.process_video_file(file_path)
-            if video_data:
-                self.database.append(video_data)
+            video_files.append(file_path)
+        return video_files
+
+    def scan_directory(self, stream_file=None):
+        """
+        Recursively scan the archive to build the complete hyperobject video ontology.
+        Maps all valid video documentation and their relationships into the database.
+
+        Only files missing from the probe cache (new or modified) are probed, and files
+        whose contents match a cached file (moved, renamed or copied) reuse its metadata.
+        With more than one worker they are probed in parallel, but entries are still added
+        in scan order so the resulting ontology matches a serial scan.
+
+        Files with the same contents as an earlier file are flagged with `duplicate_of`.
+
+        Args:
+            stream_file (str): Optional NDJSON file. Every entry is appended to it as soon as
+                               it is probed, and entries already in it (from an interrupted
+                               scan) are reused instead of being probed again.
+        """
+        video_files = self.find_video_files()
+        entries = [None] * len(video_files)
+        stats = [None] * len(video_files)
+        fingerprints = [None] * len(video_files)
+
+        resumed = self.load_stream(stream_file) if stream_file else {}
+        if stream_file:
+            # Appending after a line cut off by a crash would corrupt the next entry
+            self.repair_stream(stream_file)
+        stream = open(stream_file, 'a', encoding='utf-8') if stream_file else None
+
+        def add_entry(index, file_metadata):
+            if not file_metadata:
+                return
+            entries[index] = self.process_video_file(video_files[index], metadata=file_metadata,
+                                                     fingerprint=fingerprints[index])
+            if stream and entries[index]:
+                stream.write(json.dumps(entries[index], ensure_ascii=False) + '\n')
+                stream.flush()
+
+        try:
+            to_probe = []
+            for index, file_path in enumerate(video_files):
+                resumed_entry = resumed.get(self.get_entry_path(file_path))
+                if resumed_entry and resumed_entry.get('fingerprint'):
+                    entries[index] = resumed_entry
+                    continue
+                try:
+                    stats[index] = file_path.stat()
+                    fingerprints[index] = self.get_fingerprint(file_path, stats[index])
+                except FileNotFoundError:
+                    # Deleted between listing and stat (e.g. while watching the archive)
+                    print(f"Skipping {file_path}: removed during the scan")
+                    continue
+                cached = None
+                if self.cache is not None:
+                    cached = self.cache.get(file_path, stats[index])
+                if cached is None:
+                    cached = self.find_known_contents(file_path, fingerprints[index])
+                    if cached is not None:
+                        self.cache.put(file_path, stats[index], cached, fingerprints[index])
+                if cached is None:
+                    to_probe.append(index)
+                else:
+                    add_entry(index, cached)
+
+            if resumed:
+                print(f"Resumed {len(resumed)} entries from {stream_file}")
+            if self.cache is not None:
+                print(f"{len(video_files) - len(to_probe)} cached, {len(to_probe)} to probe")
+
+            def on_probed(position, file_metadata):
+                index = to_probe[position]
+                if file_metadata and self.cache is not None:
+                    self.cache.put(video_files[index], stats[index], file_metadata, fingerprints[index])
+                add_entry(index, file_metadata)
+
+            probe_files = [video_files[index] for index in to_probe]
+            if self.workers > 1 and len(probe_files) > 1:
+                self.probe_parallel(probe_files, on_result=on_probed)
+            else:
+                for position, file_path in enumerate(probe_files):
+                    on_probed(position, self.get_video_metadata(file_path))
+        finally:
+            if stream:
+                stream.close()
+            if self.cache is not None:
+                self.cache.save()
+
+        for entry in entries:
+            if not entry:
+                continue
+            paths = self.fingerprint_index.setdefault(entry['fingerprint'], [])
+            if paths:
+                entry['duplicate_of'] = paths[0]
+            paths.append(entry['path'])
+            if self.skip_duplicates and 'duplicate_of' in entry:
+                continue
+            self.database.append(entry)
+
+        duplicates = sum(len(paths) - 1 for paths in self.fingerprint_index.values())
+        if duplicates:
+            print(f"Found {duplicates} duplicate files")
+
+        if self.cache is not None:
+            evicted = self.cache.prune(video_files)
+            if evicted:
+                print(f"Evicted {evicted} deleted files from the probe cache")
+            self.cache.save()
+
+    def get_entry_path(self, file_path):
+        """Path of a video as stored in its ontology entry."""
+        return str(self.root_dir) + '/' + str(file_path.relative_to(self.root_dir))
+
+    @staticmethod
+    def load_stream(stream_file):
+        """
+        Read the entries of an NDJSON ontology stream.
+
+        A truncated last line (e.g. from a crash mid-write) is ignored. If a path appears
+        more than once the last entry wins.
+
+        Args:
+            stream_file (str): NDJSON file written by scan_directory
+
+        Returns:
+            dict: Ontology entries keyed by path, in first-seen order
+        """
+        entries = {}
+        if not os.path.exists(stream_file):
+            return entries
+        with open(stream_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries[entry['path']] = entry
+        return entries
+
+    @staticmethod
+    def repair_stream(stream_file):
+        """
+        Make an NDJSON stream safe to append to after a crash.
+
+        A last line without its newline is either a complete entry whose newline was
+        not written (the newline is added) or an entry cut off mid-write (the file is
+        truncated back to the end of the previous line).
+
+        Args:
+            stream_file (str): NDJSON file written by scan_directory
+
+        Returns:
+            bool: True if the file had to be repaired
+        """
+        if not os.path.exists(stream_file):
+            return False
+        with open(stream_file, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return False
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return False
+            # Find the start of the last line
+            end = size
+            start = 0
+            while end > 0:
+                chunk_start = max(0, end - (1 << 16))
+                f.seek(chunk_start)
+                newline = f.read(end - chunk_start).rfind(b'\n')
+                if newline != -1:
+                    start = chunk_start + newline + 1
+                    break
+                end = chunk_start
+            f.seek(start)
+            try:
+                json.loads(f.read())
+                f.write(b'\n')
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                print(f"Dropping truncated last line of {stream_file}")
+                f.truncate(start)
+        return True
+
+    def probe_parallel(self, video_files, on_result=None):
+        """
+        Probe video files across a pool of worker processes.
+
+        Each worker handles one file at a time, so the time a file has been in flight
+        is known exactly. A worker that exceeds `probe_timeout` on a file (e.g. a
+        corrupt clip that hangs the demuxer) is killed and replaced, and the file is
+        reported as unprocessable.
+
+        Args:
+            video_files (list): Paths of the video files to probe
+            on_result (callable): Called as on_result(index, metadata) as soon as each file
+                                  finishes, in completion order
+
+        Returns:
+            list: Technical metadata per input file, in input order. None for files that
+                  could not be processed or timed out.
+        """
+        results = [None] * len(video_files)
+        pending = iter(enumerate(video_files))
+        # conn -> [process, index of the file in flight, deadline]
+        workers = {}
+
+        def start_worker():
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_probe_worker, args=(self, child_conn), daemon=True)
+            process.start()
+            child_conn.close()
+            workers[parent_conn] = [process, None, None]
+            return parent_conn
+
+        def dispatch(conn):
+            next_file = next(pending, None)
+            if next_file is None:
+                conn.send(None)
+                workers[conn][0].join()
+                conn.close()
+                del workers[conn]
+                return
+            index, file_path = next_file
+            conn.send(file_path)
+            workers[conn][1] = index
+            workers[conn][2] = time.monotonic() + self.probe_timeout
+
+        for _ in range(min(self.workers, len(video_files))):
+            dispatch(start_worker())
+
+        while workers:
+            timeout = max(0, min(state[2] for state in workers.values()) - time.monotonic())
+            for conn in wait(list(workers), timeout=timeout):
+                process, index, _ = workers[conn]
+                try:
+                    results[index] = conn.recv()
+                except EOFError:
+                    # Worker died (e.g. the decoder crashed); replace it
+                    print(f"Worker crashed while processing {video_files[index]}")
+                    if on_result:
+                        on_result(index, None)
+                    process.join()
+                    conn.close()
+                    del workers[conn]
+                    dispatch(start_worker())
+                    continue
+                dispatch(conn)
+                if on_result:
+                    on_result(index, results[index])
+
+            now = time.monotonic()
+            for conn, (process, index, deadline) in list(workers.items()):
+                if deadline is not None and now >= deadline:
+                    print(f"Timed out after {self.probe_timeout}s: {video_files[index]}")
+                    if on_result:
+                        on_result(index, None)
+                    process.kill()
+                    process.join()
+                    conn.close()
+                    del workers[conn]
+                    dispatch(start_worker())
+
+        return results
 
     def save_database(self, output_file='ontology_map.json'):
         """
         Persist the indexed hyperobject video ontology to a JSON file.
         The resulting map captures the full structure and metadata of the video archive.
 
+        The file is written to a temporary path and renamed into place, so readers never
+        see a partially written ontology. The compact binary ontology used by the players
+        (same name, .bin suffix) and the keyframe index sidecar are written next to it.
+
         Args:
             output_file (str): Path where the ontology index will be saved. Defaults to 'ontology_map.json'.
         """
-        with open(output_file, 'w', encoding='utf-8') as f:
+        tmp_file = str(output_file) + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(self.database, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_file, output_file)
+        write_binary_ontology(self.database, binary_path(output_file), ontology_hash(output_file))
+        self.save_keyframe_index(self.database, keyframe_index_path(output_file))
+
+    def save_keyframe_index(self, videos, index_file):
+        """
+        Write the keyframe sidecar: presentation time and byte offset of every keyframe
+        of every clip, read from the MP4 sample tables. The annotator and the players use
+        it to seek straight to a keyframe instead of decoding from the previous one.
+
+        Keyframe lists are kept in the probe cache entry of each clip, so only new or
+        changed clips have their sample tables parsed again.
+
+        Args:
+            videos (list): Ontology entries to index
+            index_file (str): Path of the sidecar JSON file
+        """
+        index = {}
+        parsed = 0
+        for video in videos:
+            try:
+                stat = os.stat(video['path'])
+                keyframes = self.cache.get_keyframes(video['path'], stat) if self.cache is not None else None
+                if keyframes is None:
+                    keyframes = get_keyframe_index(video['path'])
+                    parsed += 1
+                    if self.cache is not None:
+                        self.cache.put_keyframes(video['path'], stat, keyframes)
+                index[video['path']] = keyframes
+            except (OSError, MP4ParseError) as e:
+                print(f"No keyframe index for {video['path']}: {str(e)}")
+        if parsed and self.cache is not None:
+            self.cache.save()
+
+        tmp_file = str(index_file) + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_file, index_file)
+
+    def compact_stream(self, stream_file, output_file='ontology_map.json'):
+        """
+        Turn an NDJSON ontology stream into the regular ontology JSON file.
+
+        Only the byte offset of each entry is kept in memory; entries are read back and
+        written one at a time, formatted exactly like save_database. Entries are ordered
+        like a serial scan of the archive (parallel scans stream them in completion order);
+        entries for files no longer in the archive keep their stream order at the end.
+        Duplicates are flagged (or skipped) the same way as in scan_directory.
+
+        Args:
+            stream_file (str): NDJSON file written by scan_directory
+            output_file (str): Path where the ontology index will be saved
+
+        Returns:
+            int: Number of entries written
+        """
+        # path -> offset of the latest line for that path, in first-seen order
+        offsets = {}
+        with open(stream_file, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    path = json.loads(line)['path']
+                except (json.JSONDecodeError, UnicodeDecodeError, KeyError):
+                    path = None
+                if path is not None:
+                    offsets[path] = offset
+                offset += len(line)
+
+        scan_order = {}
+        if self.root_dir.exists():
+            for file_path in self.find_video_files():
+                scan_order.setdefault(self.get_entry_path(file_path), len(scan_order))
+        ordered_offsets = sorted(
+            offsets.items(),
+            key=lambda item: scan_order.get(item[0], len(scan_order))
+        )
+
+        first_paths = {}
+        written = 0
+        tmp_file = str(output_file) + '.tmp'
+        with open(stream_file, 'rb') as f, open(tmp_file, 'w', encoding='utf-8') as out:
+            out.write('[')
+            for path, offset in ordered_offsets:
+                f.seek(offset)
+                entry = json.loads(f.readline())
+                entry.pop('duplicate_of', None)
+                fingerprint = entry.get('fingerprint')
+                if fingerprint in first_paths:
+                    if self.skip_duplicates:
+                        continue
+                    entry['duplicate_of'] = first_paths[fingerprint]
+                elif fingerprint:
+                    first_paths[fingerprint] = path
+                text = json.dumps(entry, indent=4, ensure_ascii=False)
+                out.write((',\n    ' if written else '\n    ') + text.replace('\n', '\n    '))
+                written += 1
+            out.write('\n]' if written else ']')
+        os.replace(tmp_file, output_file)
+
+        with open(output_file, 'r', encoding='utf-8') as f:
+            videos = json.load(f)
+        write_binary_ontology(videos, binary_path(output_file), ontology_hash(output_file))
+        self.save_keyframe_index(videos, keyframe_index_path(output_file))
+        return written
+
+    def snapshot(self):
+        """
+        Cheap stat-only view of the archive, used to detect changes without probing.
+
+        Returns:
+            dict: Signature (size, mtime, inode) of every video file, keyed by path
+        """
+        snapshot = {}
+        for file_path in self.find_video_files():
+            try:
+                snapshot[str(file_path)] = tuple(ProbeCache.file_signature(file_path.stat()))
+            except FileNotFoundError:
+                # Deleted between listing and stat
+                continue
+        return snapshot
+
+    def watch(self, output_file='ontology_map.json', interval=2.0, debounce=5.0, on_change=()):
+        """
+        Keep the ontology file up to date while clips are added, replaced or removed.
+
+        The archive is polled with stat-only passes every `interval` seconds. Once a change
+        has been seen and the archive has then been quiet for `debounce` seconds (so files
+        still being copied are not probed half-written), the archive is rescanned, which
+        only probes new or changed files thanks to the probe cache, and the ontology file
+        is atomically replaced.
+
+        Args:
+            output_file (str): Ontology file to keep up to date
+            interval (float): Seconds between stat passes
+            debounce (float): Seconds the archive must be unchanged before rescanning
+            on_change (iterable): Callables run with the output file after each rewrite,
+                                  e.g. to regenerate the cartography or redeploy playlists
+        """
+        def rebuild():
+            self.database = []
+            self.fingerprint_index = {}
+            try:
+                self.scan_directory()
+                self.save_database(output_file)
+            except Exception as e:
+                # Keep watching: the next change triggers another rebuild
+                print(f"Error rebuilding the ontology: {str(e)}")
+                return
+            print(f"Ontology updated: {len(self.database)} videos saved to {output_file}")
+            for callback in on_change:
+                try:
+                    callback(output_file)
+                except Exception as e:
+                    print(f"Error in change hook: {str(e)}")
+
+        print(f"Watching {self.root_dir} (poll every {interval}s, debounce {debounce}s)")
+        published = self.snapshot()
+        rebuild()
+        last_seen = published
+        last_change = None
+        try:
+            while True:
+                time.sleep(interval)
+                current = self.snapshot()
+                if current != last_seen:
+                    last_seen = current
+                    last_change = time.monotonic()
+                    continue
+                if (last_change is not None and current != published
+                        and time.monotonic() - last_change >= debounce):
+                    added = len(current.keys() - published.keys())
+                    removed = len(published.keys() - current.keys())
+                    changed = sum(1 for path in current.keys() & published.keys()
+                                  if current[path] != published[path])
+                    print(f"Archive changed: {added} added, {changed} modified, {removed} removed")
+                    published = current
+                    last_change = None
+                    rebuild()
+        except KeyboardInterrupt:
+            print("\nStopped watching")
+
+
+def run_change_command(command):
+    """Build a change hook that runs a shell command (e.g. a redeploy script)."""
+    def hook(output_file):
+        print(f"Running: {command}")
+        subprocess.run(command, shell=True, check=False,
+                       env={**os.environ, 'ONTOLOGY_FILE': str(output_file)})
+    return hook
+
+
+def regenerate_cartography(output_file):
+    """Change hook that rebuilds cartography_diagram.txt and the stats sidecar from the new ontology."""
+    from cartography_diagram import OntologyCartographer
+    cartographer = OntologyCartographer(output_file)
+    cartographer.print_tree()
+    cartographer.save_stats()
 
 def main():
     """
     Entry point for generating a complete ontological index of hyperobject video archives.
     Scans videos, infers hyperobject relationships and structure, and saves the resulting ontology.
     """
-    mapper = VideoOntologyMapper()
+    parser = argparse.ArgumentParser(description='Hyperobject video ontology mapper')
+    parser.add_argument('--root', default='Videos_hd_final',
+                      help='Root directory of the video archive')
+    parser.add_argument('--output', default='ontology_map.json',
+                      help='Output ontology file')
+    parser.add_argument('--workers', type=int, default=1,
+                      help='Number of parallel probe processes (1 = serial scan)')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                      help='Per-file probe timeout in seconds for parallel scans')
+    parser.add_argument('--cache', default='ontology_probe_cache.json',
+                      help='Persistent probe cache used to skip unchanged files')
+    parser.add_argument('--no-cache', action='store_true',
+                      help='Probe every file even if it is cached')
+    parser.add_argument('--backend', choices=VideoOntologyMapper.BACKENDS, default='cv2',
+                      help='Metadata backend: OpenCV or the MP4 header parser')
+    parser.add_argument('--stream', metavar='NDJSON',
+                      help='Append entries to this NDJSON file as they are probed and resume from it')
+    parser.add_argument('--skip-duplicates', action='store_true',
+                      help='Leave files with the same contents as an earlier file out of the ontology')
+    parser.add_argument('--compact', metavar='NDJSON',
+                      help='Only compact an existing NDJSON stream into the output file')
+    parser.add_argument('--watch', action='store_true',
+                      help='Keep running and update the output file when the archive changes')
+    parser.add_argument('--interval', type=float, default=2.0,
+                      help='Seconds between stat passes in watch mode')
+    parser.add_argument('--debounce', type=float, default=5.0,
+                      help='Seconds the archive must be quiet before rescanning in watch mode')
+    parser.add_argument('--cartography', action='store_true',
+                      help='Regenerate cartography_diagram.txt after each update in watch mode')
+    parser.add_argument('--on-change', metavar='CMD',
+                      help='Shell command run after each update in watch mode (e.g. a redeploy script)')
+    args = parser.parse_args()
+
+    mapper = VideoOntologyMapper(args.root, workers=args.workers, probe_timeout=args.timeout,
+                                 cache_file=None if args.no_cache else args.cache,
+                                 backend=args.backend, skip_duplicates=args.skip_duplicates)
+    if args.compact:
+        count = mapper.compact_stream(args.compact, args.output)
+        print(f"Compacted {count} entries from {args.compact} into {args.output}")
+        return
+
+    if args.watch:
+        hooks = []
+        if args.cartography:
+            hooks.append(regenerate_cartography)
+        if args.on_change:
+            hooks.append(run_change_command(args.on_change))
+        mapper.watch(args.output, interval=args.interval, debounce=args.debounce, on_change=hooks)
+        return
+
     print("Scanning videos...")
-    mapper.scan_directory()
+    mapper.scan_directory(stream_file=args.stream)
     print(f"Found {len(mapper.database)} videos")
-    mapper.save_database()
-    print("Database saved to ontology_map.json")
+    if args.stream:
+        mapper.compact_stream(args.stream, args.output)
+        # The scan completed, so the next run starts from scratch
+        os.remove(args.stream)
+    else:
+        mapper.save_database(args.output)
+    print(f"Database saved to {args.output}")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,608 @@
+import os
+import json
+import bisect
+import hashlib
+import mmap
+import struct
+from fractions import Fraction
+from pathlib import Path
+
+# Compact binary ontology format (little-endian):
+#
+#   header   magic, version, record size, record count, interned string count,
+#            interned table offset, path table offset, bucket index offset and
+#            SHA-1 of the JSON ontology it was written from (zeros if unknown)
+#   records  one fixed-width record per video (see RECORD)
+#   interned u32 offsets[count + 1] followed by the UTF-8 strings used for
+#            category, orientation and video type
+#   paths    u64 offsets[records + 1] followed by the UTF-8 video paths;
+#            the video name is the last path component
+#   index    u32 bucket count, one BUCKET per (category, orientation, video type)
+#            and the u32 record ids of all buckets (posting lists)
+#
+# Players mmap the file and decode records only when they are accessed.
+MAGIC = b'HOBO'
+VERSION = 4
+HEADER = struct.Struct('<4sHHIIQQQ20s')
+# category id, orientation id, video type id, width, height, fps, duration,
+# frame rate num/den, timebase num/den, frame count, duration_us, first/last pts_us
+# (frame count 0 means the entry has no exact timing fields)
+RECORD = struct.Struct('<HHHHHxxddIIIIIqqq')
+# category id, orientation id, video type id, total duration, first posting, posting count
+BUCKET = struct.Struct('<HHHxxdII')
+# Interned id used for a missing (None) category, orientation or type
+NO_STRING = 0xFFFF
+
+
+def binary_path(json_file):
+    """Path of the binary ontology that accompanies an ontology JSON file."""
+    return Path(json_file).with_suffix('.bin')
+
+
+def stats_path(json_file):
+    """Path of the stats sidecar that accompanies an ontology JSON file."""
+    json_file = Path(json_file)
+    return json_file.with_name(json_file.stem + '_stats.json')
+
+
+def keyframe_index_path(json_file):
+    """Path of the keyframe index sidecar that accompanies an ontology JSON file."""
+    json_file = Path(json_file)
+    return json_file.with_name(json_file.stem + '_keyframes.json')
+
+
+def load_keyframe_index(json_file):
+    """
+    Load the keyframe index sidecar of an ontology.
+
+    Returns:
+        dict: [pts_us, byte_offset] keyframe lists keyed by ontology path; empty if
+              the sidecar does not exist
+    """
+    index_file = keyframe_index_path(json_file)
+    if not index_file.exists():
+        return {}
+    with open(index_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def nearest_keyframe(keyframes, position):
+    """
+    Latest keyframe at or before a position, i.e. where decoding can start cheaply.
+
+    Args:
+        keyframes (list): [pts_us, byte_offset] pairs sorted by pts
+        position (float): Position in the clip in seconds
+
+    Returns:
+        float: Presentation time of the keyframe in seconds (0 without keyframes)
+    """
+    if not keyframes:
+        return 0
+    index = bisect.bisect_right(keyframes, [position * 1000000, float('inf')]) - 1
+    return keyframes[max(index, 0)][0] / 1000000
+
+
+def write_binary_ontology(videos, output_file, source_hash=None):
+    """
+    Write ontology entries in the compact binary format.
+
+    Args:
+        videos (list): Ontology entries as produced by VideoOntologyMapper
+        output_file (str): Path of the binary file, replaced atomically
+        source_hash (str): ontology_hash() of the JSON file the entries were saved to,
+                           checked by load_ontology() to detect a stale binary file
+    """
+    interned = {}
+
+    def intern(value):
+        if value is None:
+            return NO_STRING
+        return interned.setdefault(value, len(interned))
+
+    records = bytearray()
+    paths = []
+    buckets = BucketIndex.build(videos)
+    for video in videos:
+        frame_rate = Fraction(video.get('frame_rate', 0))
+        timebase = Fraction(video.get('timebase', 0))
+        records += RECORD.pack(
+            intern(video.get('category')),
+            intern(video.get('orientation')),
+            intern(video.get('video_type')),
+            video.get('width', 0),
+            video.get('height', 0),
+            float(video.get('fps', 0)),
+            float(video.get('duration', 0)),
+            frame_rate.numerator, frame_rate.denominator,
+            timebase.numerator, timebase.denominator,
+            video.get('frame_count', 0),
+            video.get('duration_us', 0),
+            video.get('first_pts_us', 0),
+            video.get('last_pts_us', 0)
+        )
+        paths.append(video['path'].encode('utf-8'))
+
+    index = bytearray(struct.pack('<I', len(buckets)))
+    postings = []
+    for key in buckets.keys():
+        ids = buckets.lookup(*key)
+        index += BUCKET.pack(*(intern(value) for value in key), buckets.duration(*key),
+                             len(postings), len(ids))
+        postings.extend(ids)
+    index += struct.pack(f'<{len(postings)}I', *postings)
+
+    interned_blob = [value.encode('utf-8') for value in interned]
+    interned_offset = HEADER.size + len(records)
+    interned_table = _offset_table('<I', interned_blob)
+    paths_offset = interned_offset + len(interned_table)
+    paths_table = _offset_table('<Q', paths)
+    index_offset = paths_offset + len(paths_table)
+
+    tmp_file = str(output_file) + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, len(paths), len(interned),
+                            interned_offset, paths_offset, index_offset,
+                            bytes.fromhex(source_hash) if source_hash else bytes(20)))
+        f.write(records)
+        f.write(interned_table)
+        f.write(paths_table)
+        f.write(index)
+    os.replace(tmp_file, output_file)
+
+
+def _offset_table(offset_format, strings):
+    """Offset array (one more entry than strings) followed by the concatenated strings."""
+    offsets = [0]
+    for value in strings:
+        offsets.append(offsets[-1] + len(value))
+    count_format = offset_format[0] + offset_format[1] * len(offsets)
+    return struct.pack(count_format, *offsets) + b''.join(strings)
+
+
+class BucketIndex:
+    """
+    Posting lists of record ids per (category, orientation, video type) bucket,
+    with the total duration of each bucket.
+
+    Replaces repeated list comprehensions over the whole ontology: looking up the
+    videos of a bucket costs the size of the bucket, not of the ontology.
+    """
+
+    def __init__(self):
+        # key -> [record ids (list, or None until read from the mmap), total duration]
+        self._buckets = {}
+        self._by_category = {}
+        self._reader = None
+
+    @classmethod
+    def build(cls, videos):
+        """Build the index in a single pass over ontology entries."""
+        index = cls()
+        for record_id, video in enumerate(videos):
+            key = (video.get('category'), video.get('orientation'), video.get('video_type'))
+            bucket = index._add(key)
+            bucket[0].append(record_id)
+            bucket[1] += video.get('duration', 0)
+        return index
+
+    def _add(self, key, ids=None, duration=0):
+        if key not in self._buckets:
+            self._buckets[key] = [[] if ids is None else ids, duration]
+            self._by_category.setdefault(key[0], []).append(key)
+        return self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def keys(self):
+        """Bucket keys in order of first appearance in the ontology."""
+        return list(self._buckets)
+
+    def categories(self):
+        """Sorted unique categories."""
+        return sorted(category for category in self._by_category if category is not None)
+
+    def lookup(self, category, orientation, video_type):
+        """Record ids of a bucket, in ontology order. Empty if the bucket does not exist."""
+        bucket = self._buckets.get((category, orientation, video_type))
+        if bucket is None:
+            return []
+        if not isinstance(bucket[0], list):
+            # Posting list still in the mmap: (first posting, count)
+            bucket[0] = self._reader(*bucket[0])
+        return bucket[0]
+
+    def duration(self, category, orientation, video_type):
+        """Total duration in seconds of a bucket."""
+        bucket = self._buckets.get((category, orientation, video_type))
+        return bucket[1] if bucket else 0
+
+    def matching_keys(self, category, orientation=None, video_type=None):
+        """Bucket keys of a category, optionally restricted to an orientation and/or type."""
+        return [key for key in self._by_category.get(category, [])
+                if (orientation is None or key[1] == orientation)
+                and (video_type is None or key[2] == video_type)]
+
+    def select(self, videos, category, orientation=None, video_type=None):
+        """
+        Videos of a category, optionally restricted to an orientation and/or type.
+
+        Args:
+            videos (sequence): The ontology the index was built from
+
+        Returns:
+            list: Matching ontology entries
+        """
+        keys = self.matching_keys(category, orientation, video_type)
+        if len(keys) == 1:
+            return [videos[record_id] for record_id in self.lookup(*keys[0])]
+        record_ids = sorted(record_id for key in keys for record_id in self.lookup(*key))
+        return [videos[record_id] for record_id in record_ids]
+
+
+def get_bucket_index(videos):
+    """Bucket index of a loaded ontology: embedded in binary ontologies, built otherwise."""
+    if isinstance(videos, BinaryOntology):
+        return videos.buckets
+    return BucketIndex.build(videos)
+
+
+class BinaryOntology:
+    """
+    Read-only, memory-mapped view of a binary ontology.
+
+    Behaves like the list loaded from ontology_map.json: len(), indexing and iteration
+    yield one dict per video with the same keys. Records are decoded on access, so
+    only the videos a player actually looks at are ever turned into dicts.
+    """
+
+    def __init__(self, bin_file, base_dir=None):
+        """
+        Map a binary ontology file.
+
+        Args:
+            bin_file (str): Path of the binary ontology
+            base_dir (str): If given, video paths are returned joined to this directory
+        """
+        self.base_dir = base_dir
+        with open(bin_file, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, record_size, self._count, interned_count,
+         interned_offset, self._paths_offset, index_offset, source_hash) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self._mm.close()
+            raise ValueError(f"Unsupported binary ontology: {bin_file}")
+        # ontology_hash() of the JSON file written alongside, None if not recorded
+        self.source_hash = source_hash.hex() if any(source_hash) else None
+
+        # The interned table is tiny (categories, orientations, types); decode it once
+        offsets = struct.unpack_from(f'<{interned_count + 1}I', self._mm, interned_offset)
+        blob_start = interned_offset + 4 * (interned_count + 1)
+        self.strings = [
+            self._mm[blob_start + offsets[i]:blob_start + offsets[i + 1]].decode('utf-8')
+            for i in range(interned_count)
+        ]
+
+        # Bucket table is decoded now; posting lists are read from the mmap on lookup
+        bucket_count = struct.unpack_from('<I', self._mm, index_offset)[0]
+        postings_offset = index_offset + 4 + bucket_count * BUCKET.size
+        self.buckets = BucketIndex()
+        self.buckets._reader = lambda first, count: list(
+            struct.unpack_from(f'<{count}I', self._mm, postings_offset + 4 * first))
+        for i in range(bucket_count):
+            category, orientation, video_type, duration, first, count = BUCKET.unpack_from(
+                self._mm, index_offset + 4 + i * BUCKET.size)
+            key = (self._string(category), self._string(orientation), self._string(video_type))
+            self.buckets._add(key, (first, count), duration)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("ontology index out of range")
+        return self.record(index)
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self.record(index)
+
+    def _string(self, string_id):
+        return None if string_id == NO_STRING else self.strings[string_id]
+
+    def path(self, index):
+        """Stored path of a video, without reading the rest of its record."""
+        start, end = struct.unpack_from('<QQ', self._mm, self._paths_offset + 8 * index)
+        blob_start = self._paths_offset + 8 * (self._count + 1)
+        return self._mm[blob_start + start:blob_start + end].decode('utf-8')
+
+    def record(self, index):
+        """Decode one video record into an ontology entry dict."""
+        (category, orientation, video_type, width, height, fps, duration,
+         rate_num, rate_den, timebase_num, timebase_den, frame_count,
+         duration_us, first_pts_us, last_pts_us) = RECORD.unpack_from(
+            self._mm, HEADER.size + index * RECORD.size)
+        path = self.path(index)
+        video = {
+            "name": path.rsplit('/', 1)[-1],
+            "path": os.path.join(self.base_dir, path) if self.base_dir else path,
+            "category": self._string(category),
+            "orientation": self._string(orientation),
+            "video_type": self._string(video_type),
+            "width": width,
+            "height": height,
+            "fps": int(fps) if fps.is_integer() else fps,
+            "duration": duration
+        }
+        if frame_count:
+            video.update({
+                "frame_rate": f"{rate_num}/{rate_den}",
+                "timebase": f"{timebase_num}/{timebase_den}",
+                "frame_count": frame_count,
+                "duration_us": duration_us,
+                "first_pts_us": first_pts_us,
+                "last_pts_us": last_pts_us
+            })
+        return video
+
+    def columns(self):
+        """
+        All records as a NumPy structured array viewing the mmap (no copy), with fields
+        category, orientation and video_type (interned string ids), width, height, fps,
+        duration, frame_rate_num/den, timebase_num/den, frame_count, duration_us,
+        first_pts_us and last_pts_us.
+        """
+        import numpy as np
+
+        dtype = np.dtype([
+            ('category', '<u2'), ('orientation', '<u2'), ('video_type', '<u2'),
+            ('width', '<u2'), ('height', '<u2'), ('pad', 'V2'),
+            ('fps', '<f8'), ('duration', '<f8'),
+            ('frame_rate_num', '<u4'), ('frame_rate_den', '<u4'),
+            ('timebase_num', '<u4'), ('timebase_den', '<u4'), ('frame_count', '<u4'),
+            ('duration_us', '<i8'), ('first_pts_us', '<i8'), ('last_pts_us', '<i8')
+        ])
+        assert dtype.itemsize == RECORD.size
+        return np.frombuffer(self._mm, dtype=dtype, count=self._count, offset=HEADER.size)
+
+    def close(self):
+        self._mm.close()
+
+
+def clip_duration(video):
+    """
+    Exact duration of a clip in seconds, for scheduling.
+
+    Uses the microsecond duration recorded by the mapper and falls back to the
+    rounded `duration` of older ontologies.
+    """
+    if video.get('duration_us'):
+        return video['duration_us'] / 1000000
+    return video.get('duration', 0)
+
+
+def load_ontology(json_file, base_dir=None):
+    """
+    Load the ontology for playback, preferring the binary format.
+
+    The binary file next to `json_file` is memory-mapped if it exists (the mapper
+    always writes both together); otherwise the JSON file is parsed. A binary file
+    older than the JSON file or written from different JSON contents (e.g. when only
+    the JSON was edited or deployed) is stale and ignored with a warning.
+
+    Args:
+        json_file (str): Path of ontology_map.json
+        base_dir (str): If given, video paths are made absolute relative to it
+
+    Returns:
+        BinaryOntology or list: Sequence of ontology entry dicts
+    """
+    bin_file = binary_path(json_file)
+    if bin_file.exists():
+        try:
+            if bin_file.stat().st_mtime_ns < os.stat(json_file).st_mtime_ns:
+                raise ValueError(f"Binary ontology {bin_file} is older than {json_file}")
+            ontology = BinaryOntology(bin_file, base_dir)
+            if ontology.source_hash and ontology.source_hash != ontology_hash(json_file):
+                ontology.close()
+                raise ValueError(f"Binary ontology {bin_file} was written from another {json_file}")
+            return ontology
+        except ValueError as e:
+            print(f"Warning: {e}, falling back to {json_file}")
+
+    with open(json_file, 'r', encoding='utf-8') as f:
+        videos = json.load(f)
+    if base_dir:
+        for video in videos:
+            video['path'] = os.path.join(base_dir, video['path'])
+    return videos
+
+
+# Version of the stats sidecar layout; sidecars of another version are recomputed
+STATS_VERSION = 2
+# Devices of the installation and the offline players' text cadence: one text clip
+# after every third animated clip (positions 1, 4, 7, ... of the animated list)
+NODES = ('hor1', 'hor2', 'ver1', 'ver2')
+TEXT_EVERY = 3
+# The master's synchronized playlists: text clips go to the first node of a pair at
+# positions (i + 1) * MASTER_TEXT_INTERVAL + MASTER_TEXT_OFFSETS[orientation], while
+# the second node waits on an empty slot
+MASTER_TEXT_INTERVAL = 3
+MASTER_TEXT_OFFSETS = {'hor': 0, 'ver': 2}
+
+
+def ontology_hash(json_file):
+    """SHA-1 of the contents of an ontology file, identifying the ontology a sidecar was built from."""
+    digest = hashlib.sha1()
+    with open(json_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def node_playlist_counts(animated, text):
+    """
+    Animated and text clips each node of a pair plays per category in the offline players.
+
+    Mirrors OfflinePlayer.prepare_category_playlist: text clips are interleaved after
+    every TEXT_EVERY-th animated clip and the nodes take alternate playlist positions.
+
+    Returns:
+        tuple: ((animated, text) for node 1, (animated, text) for node 2)
+    """
+    playlist = []
+    text_left = text
+    for i in range(animated):
+        playlist.append('animated')
+        if i % TEXT_EVERY == 1 and text_left:
+            playlist.append('text')
+            text_left -= 1
+    return tuple(
+        (playlist[node::2].count('animated'), playlist[node::2].count('text'))
+        for node in (0, 1)
+    )
+
+
+def master_playlist_counts(animated, text, offset):
+    """
+    Clips each node of a pair plays per category in the master's synchronized playlists.
+
+    Mirrors MasterNode.create_synchronized_playlist: the first node takes every other
+    animated clip and the text clips that fit at positions (i + 1) * MASTER_TEXT_INTERVAL
+    + offset; the second node takes the remaining animated clips and waits while each
+    of those text clips plays.
+
+    Returns:
+        tuple: ((animated, text) for the first node, (animated, waits) for the second)
+    """
+    first = (animated + 1) // 2
+    inserted = 0
+    for i in range(text):
+        if (i + 1) * MASTER_TEXT_INTERVAL + offset < first + inserted:
+            inserted += 1
+    return (first, inserted), (animated - first, inserted)
+
+
+def build_stats(buckets, ontology_hash=None):
+    """
+    Materialize playback statistics from per-bucket counts and durations.
+
+    Args:
+        buckets (iterable): (category, orientation, video_type, count, total duration)
+                            tuples, in order of first appearance
+        ontology_hash (str): ontology_hash() of the ontology they were computed from
+
+    Returns:
+        dict: 'version', 'ontology_hash', 'buckets' (one dict per bucket), 'categories'
+              (count and duration per category), 'nodes': per device and category,
+              the clips it plays per loop in the offline players and the expected loop
+              length in seconds (clip counts times the mean clip duration of their
+              bucket), and 'master': the same for the master's synchronized playlists,
+              with each category's animated and text clips and the waits on the
+              partner's text clips, which count towards the loop length
+    """
+    bucket_list = []
+    categories = {}
+    by_key = {}
+    for category, orientation, video_type, count, duration in buckets:
+        bucket_list.append({'category': category, 'orientation': orientation, 'video_type': video_type,
+                            'count': count, 'duration': round(duration, 6)})
+        by_key[(category, orientation, video_type)] = (count, duration)
+        if category is not None:
+            totals = categories.setdefault(category, {'count': 0, 'duration': 0})
+            totals['count'] += count
+            totals['duration'] = round(totals['duration'] + duration, 6)
+
+    def mean_duration(key):
+        count, duration = by_key.get(key, (0, 0))
+        return duration / count if count else 0
+
+    def add(layout, node, category, clips, loop_length, **counts):
+        totals = layout[node]
+        totals['categories'][category] = {**counts, 'clips': clips, 'loop_length': round(loop_length, 3)}
+        totals['clips'] += clips
+        totals['loop_length'] = round(totals['loop_length'] + loop_length, 3)
+
+    nodes = {node: {'clips': 0, 'loop_length': 0, 'categories': {}} for node in NODES}
+    master = {node: {'clips': 0, 'loop_length': 0, 'categories': {}} for node in NODES}
+    for category in sorted(categories):
+        for orientation in ('hor', 'ver'):
+            animated_key = (category, orientation, 'animated')
+            text_key = (category, orientation, 'text')
+            animated_count = by_key.get(animated_key, (0, 0))[0]
+            text_count = by_key.get(text_key, (0, 0))[0]
+
+            def length(animated, text):
+                return animated * mean_duration(animated_key) + text * mean_duration(text_key)
+
+            counts = node_playlist_counts(animated_count, text_count)
+            for number, (animated, text) in enumerate(counts, 1):
+                add(nodes, f"{orientation}{number}", category, animated + text, length(animated, text))
+
+            (animated, text), (partner_animated, waits) = master_playlist_counts(
+                animated_count, text_count, MASTER_TEXT_OFFSETS[orientation])
+            add(master, f"{orientation}1", category, animated + text, length(animated, text),
+                animated=animated, text=text, waits=0)
+            add(master, f"{orientation}2", category, partner_animated, length(partner_animated, waits),
+                animated=partner_animated, text=0, waits=waits)
+
+    return {
+        'version': STATS_VERSION,
+        'ontology_hash': ontology_hash,
+        'buckets': bucket_list,
+        'categories': categories,
+        'nodes': nodes,
+        'master': master
+    }
+
+
+def write_stats(stats, stats_file):
+    """Write a stats sidecar atomically."""
+    tmp_file = str(stats_file) + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, stats_file)
+
+
+def load_stats(json_file, buckets):
+    """
+    Playback statistics of an ontology, from its sidecar when it is current.
+
+    The sidecar is used if its version and ontology hash match `json_file`;
+    otherwise the statistics are recomputed from the bucket index and the sidecar
+    is rewritten (if the directory is writable).
+
+    Args:
+        json_file (str): Path of ontology_map.json
+        buckets (BucketIndex): Bucket index of the loaded ontology
+
+    Returns:
+        dict: See build_stats()
+    """
+    current_hash = ontology_hash(json_file)
+    stats_file = stats_path(json_file)
+    if stats_file.exists():
+        try:
+            with open(stats_file, 'r', encoding='utf-8') as f:
+                stats = json.load(f)
+            if stats.get('version') == STATS_VERSION and stats.get('ontology_hash') == current_hash:
+                return stats
+        except (OSError, ValueError):
+            pass
+
+    print(f"Recomputing ontology stats ({stats_file} missing or stale)")
+    stats = build_stats(
+        ((*key, len(buckets.lookup(*key)), buckets.duration(*key)) for key in buckets.keys()),
+        current_hash
+    )
+    try:
+        write_stats(stats, stats_file)
+    except OSError as e:
+        print(f"Could not write {stats_file}: {e}")
+    return stats
@@ -0,0 +1,100 @@
+"""
+Localhost test of the master-slave clock synchronization.
+
+Runs a clock server and a slave on 127.0.0.1, with the slave's clock off by --offset
+seconds and every ping and pong held back by a random one-way delay (plus occasional
+--spike delays, e.g. a congested network). Prints the estimated offset and error bound
+over time and checks that the final estimate is within the error bound of the truth.
+
+Run from the repository root with com_scripts on the path:
+    PYTHONPATH=com_scripts python3 test_scripts/test_clock_sync.py --offset 0.25 --delay 0.01
+"""
+import sys
+import time
+import random
+import argparse
+from oscpy.server import OSCThreadServer
+from clock_sync import ClockServer, ClockSync
+
+
+class DelayedClockServer(ClockServer):
+    """Clock server whose pongs spend a simulated time on the network"""
+
+    def __init__(self, server, sock, delay):
+        super().__init__(server, sock)
+        self.delay = delay
+
+    def _send(self, sock, address, port, values):
+        time.sleep(self.delay())
+        super()._send(sock, address, port, values)
+
+
+class DelayedClockSync(ClockSync):
+    """Slave clock whose pings spend a simulated time on the network"""
+
+    def __init__(self, *args, delay, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+
+    def _send(self, values):
+        time.sleep(self.delay())
+        super()._send(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Test clock synchronization on localhost')
+    parser.add_argument('--offset', type=float, default=0.25,
+                        help='Seconds the slave clock is behind the master')
+    parser.add_argument('--delay', type=float, default=0.01, help='Mean one-way delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.005, help='One-way delay jitter in seconds')
+    parser.add_argument('--spike', type=float, default=0.1, help='Extra delay of outlier packets in seconds')
+    parser.add_argument('--spike-rate', type=float, default=0.1, help='Fraction of delayed outlier packets')
+    parser.add_argument('--interval', type=float, default=0.5, help='Seconds between pings')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+
+    def delay():
+        value = max(0.0, rng.gauss(args.delay, args.jitter))
+        if rng.random() < args.spike_rate:
+            value += args.spike
+        return value
+
+    master = OSCThreadServer()
+    master_sock = master.listen(address='127.0.0.1', port=0, default=True)
+    master_port = master_sock.getsockname()[1]
+    DelayedClockServer(master, master_sock, delay)
+
+    slave = OSCThreadServer()
+    slave_sock = slave.listen(address='127.0.0.1', port=0, default=True)
+    clock = DelayedClockSync(
+        slave, '127.0.0.1', master_port, sock=slave_sock, interval=args.interval,
+        clock=lambda: time.time() - args.offset, delay=delay
+    )
+
+    print(f"=== Clock Sync Test: slave {args.offset * 1000:+.1f} ms off, "
+          f"delay {args.delay * 1000:.1f} ± {args.jitter * 1000:.1f} ms ===")
+    clock.start()
+    start = time.monotonic()
+    while time.monotonic() - start < args.duration:
+        time.sleep(1.0)
+        if clock.synchronized:
+            print(f"{time.monotonic() - start:5.1f}s  offset {clock.offset * 1000:+8.3f} ms  "
+                  f"error ±{clock.error * 1000:.3f} ms  "
+                  f"(actual error {(clock.offset - args.offset) * 1000:+.3f} ms)")
+    clock.stop()
+
+    actual = abs(clock.offset - args.offset)
+    ok = clock.synchronized and actual <= clock.error
+    print(f"\nFinal error {actual * 1000:.3f} ms, bound {clock.error * 1000:.3f} ms: "
+          f"{'PASS' if ok else 'FAIL'}")
+    master.stop_all()
+    slave.stop_all()
+    master.terminate_server()
+    slave.terminate_server()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Resuming an interrupted streamed scan (ontology_maper.py --stream).
+
+Builds a small archive of synthetic clips, streams a scan to NDJSON, cuts the last
+line of the stream off mid-entry as a crash would, then resumes the scan and compacts
+the stream. Every clip must end up in the ontology.
+
+Run from the repository root:
+    PYTHONPATH=. python3 -m pytest test_scripts/test_ontology_stream.py
+"""
+import os
+import json
+import tempfile
+import cv2
+import numpy as np
+from ontology_maper import VideoOntologyMapper
+
+
+def write_clip(path, frames=12, fps=24, seed=0):
+    """Write a short synthetic MP4 clip"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (64, 36))
+    for _ in range(frames):
+        writer.write(rng.integers(0, 255, (36, 64, 3), dtype=np.uint8))
+    writer.release()
+
+
+def test_resume_from_truncated_stream():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, 'archive')
+        for i in range(4):
+            write_clip(os.path.join(root, 'DEFORESTACION', 'hor', 'animated', f"clip{i}_hor.mp4"), seed=i)
+        stream_file = os.path.join(tmp, 'scan.ndjson')
+        output_file = os.path.join(tmp, 'ontology_map.json')
+
+        VideoOntologyMapper(root).scan_directory(stream_file=stream_file)
+        with open(stream_file, 'rb') as f:
+            lines = f.readlines()
+        assert len(lines) == 4
+
+        # Crash in the middle of writing the last entry
+        with open(stream_file, 'wb') as f:
+            f.writelines(lines[:3])
+            f.write(lines[3][:len(lines[3]) // 2])
+
+        mapper = VideoOntologyMapper(root)
+        mapper.scan_directory(stream_file=stream_file)
+        with open(stream_file, 'rb') as f:
+            for line in f:
+                json.loads(line)
+        assert mapper.compact_stream(stream_file, output_file) == 4
+        with open(output_file, 'r', encoding='utf-8') as f:
+            assert len(json.load(f)) == 4
+
+
+def test_repair_complete_line_without_newline():
+    with tempfile.TemporaryDirectory() as tmp:
+        stream_file = os.path.join(tmp, 'scan.ndjson')
+        with open(stream_file, 'w', encoding='utf-8') as f:
+            f.write('{"path": "a"}\n{"path": "b"}')
+        assert VideoOntologyMapper.repair_stream(stream_file)
+        with open(stream_file, 'a', encoding='utf-8') as f:
+            f.write('{"path": "c"}\n')
+        assert list(VideoOntologyMapper.load_stream(stream_file)) == ['a', 'b', 'c']
@@ -0,0 +1,99 @@
+"""
+Perceptual response cache of the hyperobject annotator.
+
+Different text cards and dark frames must not share a cached description, while a
+re-encoded copy of a detailed frame still reuses its description.
+
+Run from the repository root:
+    PYTHONPATH=analysis_scripts python3 -m pytest test_scripts/test_response_cache.py
+"""
+import os
+import tempfile
+import threading
+import cv2
+import numpy as np
+from hyperobject_annotator import ResponseCache
+
+
+def text_card(lines):
+    """White text on black, like the archive's text clips"""
+    frame = np.zeros((1080, 1920, 3), np.uint8)
+    for i, line in enumerate(lines):
+        cv2.putText(frame, line, (200, 400 + i * 120), cv2.FONT_HERSHEY_SIMPLEX, 2.0, (255, 255, 255), 3)
+    return frame
+
+
+def textured_frame(seed):
+    rng = np.random.default_rng(seed)
+    return cv2.resize(rng.integers(0, 256, (9, 16, 3), dtype=np.uint8), (1920, 1080),
+                      interpolation=cv2.INTER_CUBIC)
+
+
+def reencode(frame, quality=60):
+    return cv2.imdecode(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1], cv2.IMREAD_COLOR)
+
+
+def new_cache(tmp):
+    return ResponseCache(os.path.join(tmp, 'cache.json'))
+
+
+def test_text_cards_do_not_share_descriptions():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = new_cache(tmp)
+        context = ResponseCache.context('DEFORESTACION', {})
+        first = text_card(["La deforestacion avanza", "cada ano mas rapido"])
+        second = text_card(["Los oceanos se calientan", "y el hielo retrocede"])
+        cache.put(context, cache.frame_key(first, 'fingerprint-1'), 'Texto sobre deforestacion')
+        assert cache.get(context, cache.frame_key(second, 'fingerprint-2')) is None
+        assert cache.get(context, cache.frame_key(first, 'fingerprint-1')) == 'Texto sobre deforestacion'
+
+
+def test_dark_frames_do_not_share_descriptions():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = new_cache(tmp)
+        context = ResponseCache.context('WILDFIRE', {})
+        cache.put(context, cache.frame_key(np.full((1080, 1920, 3), 3, np.uint8), 'a'), 'Fundido a negro')
+        assert cache.get(context, cache.frame_key(np.full((1080, 1920, 3), 12, np.uint8), 'b')) is None
+
+
+def test_detailed_frames_match_reencoded_copies():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = new_cache(tmp)
+        context = ResponseCache.context('NATURALEZA-ANIMALES', {})
+        frame = textured_frame(0)
+        cache.put(context, cache.frame_key(frame, 'a'), 'Un bosque')
+        cache.save()
+        cache = new_cache(tmp)
+        assert cache.get(context, cache.frame_key(reencode(frame), 'b')) == 'Un bosque'
+        assert cache.get(context, cache.frame_key(np.rot90(frame).copy(), 'c')) == 'Un bosque'
+        assert cache.get(context, cache.frame_key(textured_frame(1), 'd')) is None
+
+
+def test_concurrent_lookups_and_stores():
+    """Worker threads look frames up while the event loop stores and saves descriptions"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResponseCache(os.path.join(tmp, 'cache.json'), max_entries=200)
+        context = ResponseCache.context('WILDFIRE', {})
+        keys = [cache.frame_key(textured_frame(seed), seed) for seed in range(20)]
+        errors = []
+        done = threading.Event()
+
+        def look_up():
+            try:
+                while not done.is_set():
+                    for key in keys:
+                        cache.get(context, key)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=look_up) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for i in range(2000):
+            cache.put(context, [i * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF], f"Descripcion {i}")
+            if i % 500 == 0:
+                cache.save()
+        done.set()
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
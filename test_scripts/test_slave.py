@@ -1,5 +1,5 @@
-import json
 import os
+from ontology_store import load_ontology, get_bucket_index
 import pygame
 from ffpyplayer.player import MediaPlayer
 import random
@@ -9,16 +9,10 @@ from threading import Thread, Event
 import warnings
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
-def get_absolute_video_path(relative_path):
-    """Convert relative video path to absolute path"""
-    base_dir = '/home/pi/video_player'
-    return os.path.join(base_dir, relative_path)
+BASE_DIR = '/home/pi/video_player'
 
-# Load metadata
-with open('/home/pi/video_player/ontology_map.json', 'r') as f:
-    videos = json.load(f)
-    for video in videos:
-        video['path'] = get_absolute_video_path(video['path'])
+# Load metadata (memory-mapped binary ontology when available, JSON otherwise)
+videos = load_ontology(os.path.join(BASE_DIR, 'ontology_map.json'), base_dir=BASE_DIR)
 
 class TestPlayer:
     def __init__(self, orientation):
@@ -31,8 +25,11 @@ class TestPlayer:
         self.command_queue = Queue()
         self.video_finished = Event()
         
+        # Bucket index: (category, orientation, type) -> videos, looked up in O(1)
+        self.buckets = get_bucket_index(videos)
+        
         # Get unique categories in alphabetical order
-        self.categories = sorted(set(video['category'] for video in videos))
+        self.categories = self.buckets.categories()
         print(f"\nFound {len(self.categories)} categories: {self.categories}")
         
         # Initialize pygame display
@@ -66,12 +63,9 @@ class TestPlayer:
 
     def prepare_category_playlist(self, category):
         """Prepare a playlist for a category that alternates between animated and text videos"""
-        # Filter videos for this category and orientation
-        category_videos = [v for v in videos if v['category'] == category and v['orientation'].lower() == self.orientation]
-        
-        # Separate animated and text videos
-        animated_videos = [v for v in category_videos if v['video_type'] == 'animated']
-        text_videos = [v for v in category_videos if v['video_type'] == 'text']
+        # Look up animated and text videos for this category and orientation
+        animated_videos = self.buckets.select(videos, category, self.orientation, 'animated')
+        text_videos = self.buckets.select(videos, category, self.orientation, 'text')
         
         # Shuffle both lists
         random.shuffle(animated_videos)